@@ -1,21 +1,69 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from typing import List, Optional
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from pydantic import BaseModel, Field
 import uvicorn
 import os
-from .services.document_processor import DocumentProcessor
+import json
+import asyncio
+from .services.document_processor import (
+    DocumentProcessor,
+    EMBED_POOL,
+    STATS_REFRESH_SECONDS,
+    run_blocking
+)
 from .services.query_service import QueryService
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Files processed at once per upload request, bounds parallel transformer calls
+UPLOAD_CONCURRENCY = os.cpu_count() or 1
+# Most queries accepted by one /query/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "32"))
+
+@lru_cache(maxsize=1)
+def build_document_processor() -> DocumentProcessor:
+    return DocumentProcessor(
+        weaviate_url=os.getenv("WEAVIATE_URL", "http://localhost:8080")
+    )
+
+@lru_cache(maxsize=1)
+def build_query_service() -> QueryService:
+    return QueryService(build_document_processor())
+
+async def refresh_periodically(doc_processor: DocumentProcessor):
+    """Refresh cached statistics, catch the vector index up with Weaviate, and expire cached answers."""
+    while True:
+        await asyncio.sleep(STATS_REFRESH_SECONDS)
+        await run_blocking(doc_processor.refresh_document_statistics)
+        await run_blocking(doc_processor.sync_vector_index)
+        await run_blocking(doc_processor.expire_cached_responses)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the models and connect to Weaviate once, shared by every request
+    app.state.doc_processor = build_document_processor()
+    app.state.query_service = build_query_service()
+    await run_blocking(app.state.doc_processor.refresh_document_statistics)
+    await run_blocking(app.state.doc_processor.sync_vector_index)
+    refresh_task = asyncio.create_task(refresh_periodically(app.state.doc_processor))
+    yield
+    refresh_task.cancel()
+    await app.state.query_service.aclose()
+    EMBED_POOL.shutdown(wait=True)
+    app.state.doc_processor.save_vector_index()
+    app.state.doc_processor.doc_preprocessor.close()
+
 app = FastAPI(
     title="SOX Compliance RAG API",
     description="API for SOX compliance document processing and querying",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Configure CORS
@@ -66,14 +114,15 @@ class QueryRequest(BaseModel):
         description="Include detailed query analysis in response"
     )
 
+class QueryRequestBatch(BaseModel):
+    queries: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES)
+
 # Dependencies
-def get_document_processor():
-    return DocumentProcessor(
-        weaviate_url=os.getenv("WEAVIATE_URL", "http://localhost:8080")
-    )
+def get_document_processor(request: Request) -> DocumentProcessor:
+    return request.app.state.doc_processor
 
-def get_query_service(doc_processor: DocumentProcessor = Depends(get_document_processor)):
-    return QueryService(doc_processor)
+def get_query_service(request: Request) -> QueryService:
+    return request.app.state.query_service
 
 @app.get("/")
 async def root():
@@ -93,14 +142,25 @@ async def upload_documents(
     Handles PDF, DOCX, and image files with OCR capabilities.
     """
     try:
-        total_chunks = 0
-        for file in files:
-            content = await file.read()
-            chunks_processed = await doc_processor.process_uploaded_file(
-                content,
-                file.filename
-            )
-            total_chunks += chunks_processed
+        semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def process_file(file: UploadFile) -> int:
+            async with semaphore:
+                # Uploads are already spooled to disk by the multipart parser,
+                # so the preprocessor reads the spooled file directly
+                return await doc_processor.process_uploaded_file(file.file, file.filename)
+
+        # Let every file finish before the uploads are closed, even when
+        # another one fails
+        chunks_processed = await asyncio.gather(
+            *(process_file(file) for file in files),
+            return_exceptions=True
+        )
+
+        for result in chunks_processed:
+            if isinstance(result, BaseException):
+                raise result
+        total_chunks = sum(chunks_processed)
 
         # Get updated statistics
         statistics = doc_processor.get_document_statistics()
@@ -135,6 +195,45 @@ async def query_documents(
             detail=f"Error processing query: {str(e)}"
         )
 
+@app.post("/query/stream")
+async def query_documents_stream(
+    request: QueryRequest,
+    query_service: QueryService = Depends(get_query_service)
+):
+    """
+    Query the SOX compliance documents, streaming the answer as Server-Sent Events.
+    Emits `{"token": ...}` frames, then a final frame with sources and confidence.
+    """
+    async def event_stream():
+        try:
+            async for event in query_service.stream_query(request.query):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming query: {str(e)}")
+            error = {"error": f"Error processing query: {str(e)}"}
+            yield f"data: {json.dumps(error)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+@app.post("/query/batch", response_model=List[QueryResponse])
+async def query_documents_batch(
+    request: QueryRequestBatch,
+    query_service: QueryService = Depends(get_query_service)
+):
+    """
+    Query the SOX compliance documents with several queries at once.
+    Identical queries are answered once.
+    """
+    try:
+        results = await query_service.process_queries(request.queries)
+        return [QueryResponse(**result) for result in results]
+    except Exception as e:
+        logger.error(f"Error processing queries: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing queries: {str(e)}"
+        )
+
 @app.get("/statistics")
 async def get_statistics(
     doc_processor: DocumentProcessor = Depends(get_document_processor)
@@ -1,32 +1,265 @@
 import weaviate
-from typing import List, Dict, Any, Optional
+from weaviate.data.replication import ConsistencyLevel
+from weaviate.util import generate_uuid5
+from typing import List, Dict, Any, BinaryIO, Iterable, Iterator, Optional, Union
 import os
+import json
+import asyncio
+import threading
+import hashlib
+import time
+from collections import Counter
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import tempfile
 import logging
+import hnswlib
+import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
 from ..utils.document_preprocessor import DocumentPreprocessor
+from ..utils.embedding_cache import EmbeddingCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+EMBEDDING_DIM = 384
+# Compile the embedding model with torch.compile, set to 0 to run it eagerly
+EMBEDDER_COMPILE = os.getenv("EMBEDDER_COMPILE", "1") == "1"
+# Texts per SentenceTransformer forward pass
+EMBED_BATCH_SIZE = 64
+# Chunks encoded per call, caps peak memory on very large uploads
+EMBED_SUB_BATCH_SIZE = 2048
+# Weaviate import tuning, re-tune per cluster
+WEAVIATE_BATCH_SIZE = int(os.getenv("WEAVIATE_BATCH_SIZE", "200"))
+WEAVIATE_CONCURRENCY = int(os.getenv("WEAVIATE_CONCURRENCY", "4"))
+# Product quantization of the HNSW vectors, trained once enough chunks are indexed
+PQ_SEGMENTS = 96  # 384 dims / 4 dims per 1-byte code
+PQ_MIN_OBJECTS = int(os.getenv("WEAVIATE_PQ_MIN_OBJECTS", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+# Cosine similarity above which a previous answer is reused for a new query
+QUERY_CACHE_MIN_SIMILARITY = float(os.getenv("QUERY_CACHE_MIN_SIMILARITY", "0.97"))
+# Seconds a cached answer is reused before it expires
+QUERY_CACHE_TTL_SECONDS = int(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+# In-process HNSW index mirroring the Document vectors for low-latency search
+VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "data/vector_index.bin")
+VECTOR_INDEX_INITIAL_CAPACITY = 10000
+VECTOR_INDEX_EF = 128
+# Cosine distance equivalent of the Weaviate certainty threshold of 0.7
+MAX_COSINE_DISTANCE = 0.6
+# Chunks fetched by id per request, well under Weaviate's QUERY_MAXIMUM_RESULTS
+FETCH_PAGE_SIZE = 500
+
+# Seconds between background refreshes of the cached statistics from Weaviate
+STATS_REFRESH_SECONDS = int(os.getenv("STATS_REFRESH_SECONDS", "60"))
+
+# Shared pool for blocking embedding, model, and Weaviate calls made from async handlers
+EMBED_POOL = ThreadPoolExecutor(
+    max_workers=2 * (os.cpu_count() or 1),
+    thread_name_prefix="embed"
+)
+
+async def run_blocking(func, *args):
+    """Run a blocking call on the embedding pool without stalling the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(EMBED_POOL, func, *args)
+
+# Serializes schema creation between threads of this process
+_SCHEMA_LOCK = threading.Lock()
+
+# Properties returned for retrieved document chunks
+DOCUMENT_FIELDS = [
+    "content",
+    "source",
+    "page",
+    "chunk_type",
+    "metadata"
+]
+
 class DocumentProcessor:
     def __init__(self, weaviate_url: Optional[str] = None):
         """Initialize the document processor with Weaviate client and embedding model."""
         self.client = weaviate.Client(
             url=weaviate_url or os.getenv("WEAVIATE_URL", "http://localhost:8080")
         )
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        self.embedder = SentenceTransformer(
+            'all-MiniLM-L6-v2',
+            device="cuda" if torch.cuda.is_available() else "cpu"
+        )
+        if EMBEDDER_COMPILE:
+            self._compile_embedder()
+        self.embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+        # Query embeddings are only worth keeping while they are hot, so never persist them
+        self.query_embedding_cache = EmbeddingCache()
+        # Cached answers older than the last write to the corpus are stale
+        self._corpus_updated_at = 0.0
         self.doc_preprocessor = DocumentPreprocessor()
+        self._compression_enabled = False
+        self._schema_ready = False
         self._setup_schema()
 
+        # The client's batch is shared, so concurrent uploads take turns flushing it
+        self.client.batch.configure(
+            batch_size=WEAVIATE_BATCH_SIZE,
+            dynamic=False,
+            num_workers=WEAVIATE_CONCURRENCY,
+            timeout_retries=3,
+            consistency_level=ConsistencyLevel.ONE,
+            callback=self._record_batch_results
+        )
+        self._batch_lock = threading.Lock()
+        self._batch_stored_ids = set()
+
+        self._index_lock = threading.Lock()
+        self._load_vector_index()
+
+        # Statistics are counted on write and periodically refreshed from Weaviate
+        self._stats_lock = threading.Lock()
+        self._chunk_count = 0
+        self._type_counts = Counter()
+
+    def _compile_embedder(self):
+        """Compile the encoder's forward pass, falling back to eager mode if compilation fails."""
+        module = self.embedder._first_module()
+        eager_model = module.auto_model
+        # Recompiles can happen on any later call, so have those fall back to
+        # eager execution too instead of failing the request
+        torch._dynamo.config.suppress_errors = True
+        try:
+            # The default mode, as CUDA graphs ("reduce-overhead") replay into
+            # static buffers and aren't safe to call from the concurrent
+            # EMBED_POOL threads
+            module.auto_model = torch.compile(
+                eager_model,
+                dynamic=True  # Batches vary in length, avoid recompiling per shape
+            )
+            # Compile now rather than on the first request
+            self._embed(["SOX compliance warm-up"])
+        except Exception as e:
+            logger.warning(f"Could not compile embedding model, running eagerly: {str(e)}")
+            module.auto_model = eager_model
+
+    def _load_vector_index(self):
+        """Load the local vector index from disk, or start an empty one."""
+        self.vector_index = hnswlib.Index(space='cosine', dim=EMBEDDING_DIM)
+        ids_path = f"{VECTOR_INDEX_PATH}.ids.json"
+
+        if os.path.exists(VECTOR_INDEX_PATH) and os.path.exists(ids_path):
+            with open(ids_path) as f:
+                self._index_ids = json.load(f)
+            self._index_id_set = set(self._index_ids)
+            self.vector_index.load_index(
+                VECTOR_INDEX_PATH,
+                max_elements=max(len(self._index_ids), VECTOR_INDEX_INITIAL_CAPACITY)
+            )
+            logger.info(f"Loaded vector index with {len(self._index_ids)} chunks")
+        else:
+            # Labels are positions in this list of Weaviate object ids
+            self._index_ids = []
+            self._index_id_set = set()
+            self.vector_index.init_index(
+                max_elements=VECTOR_INDEX_INITIAL_CAPACITY,
+                ef_construction=200,
+                M=16
+            )
+
+        self.vector_index.set_ef(VECTOR_INDEX_EF)
+
+    def save_vector_index(self):
+        """Persist the local vector index and its id mapping to disk."""
+        ids_path = f"{VECTOR_INDEX_PATH}.ids.json"
+        Path(VECTOR_INDEX_PATH).parent.mkdir(parents=True, exist_ok=True)
+
+        with self._index_lock:
+            self.vector_index.save_index(VECTOR_INDEX_PATH)
+            with open(ids_path, "w") as f:
+                json.dump(self._index_ids, f)
+        logger.info(f"Saved vector index with {len(self._index_ids)} chunks")
+
+    def sync_vector_index(self):
+        """Add Document vectors that exist in Weaviate but not yet in the local index.
+
+        Picks up chunks stored through other replicas, so answers cached before
+        they were indexed here are invalidated and the index is saved.
+        """
+        try:
+            # Relies on the chunk count from the latest statistics refresh
+            if self._chunk_count <= self.vector_index.get_current_count():
+                return
+
+            known_ids = set(self._index_id_set)
+            added = 0
+            after = None
+            while True:
+                query = (
+                    self.client.query
+                    .get("Document")
+                    .with_additional(["id", "vector"])
+                    .with_limit(1000)
+                )
+                if after is not None:
+                    query = query.with_after(after)
+                objects = query.do()["data"]["Get"]["Document"]
+                if not objects:
+                    break
+
+                missing = [
+                    obj["_additional"] for obj in objects
+                    if obj["_additional"]["id"] not in known_ids
+                ]
+                if missing:
+                    added += self._add_to_vector_index(
+                        np.array([obj["vector"] for obj in missing], dtype=np.float32),
+                        [obj["id"] for obj in missing]
+                    )
+                    known_ids.update(obj["id"] for obj in missing)
+                after = objects[-1]["_additional"]["id"]
+
+            logger.info(f"Synced vector index to {len(self._index_ids)} chunks")
+            if added:
+                self.invalidate_cached_responses()
+                self.save_vector_index()
+        except Exception as e:
+            logger.error(f"Error syncing vector index: {str(e)}")
+
+    def _add_to_vector_index(self, embeddings: np.ndarray, object_ids: List[str]) -> int:
+        """Add embeddings to the local vector index, growing it as needed, and return how many were new."""
+        with self._index_lock:
+            # Concurrent uploads of the same content must not index it twice
+            keep = [i for i, object_id in enumerate(object_ids) if object_id not in self._index_id_set]
+            if not keep:
+                return 0
+            embeddings = embeddings[keep]
+            object_ids = [object_ids[i] for i in keep]
+
+            start = len(self._index_ids)
+            required = start + len(object_ids)
+            capacity = self.vector_index.get_max_elements()
+            if required > capacity:
+                self.vector_index.resize_index(max(required, capacity * 2))
+
+            self.vector_index.add_items(embeddings, np.arange(start, required))
+            self._index_ids.extend(object_ids)
+            self._index_id_set.update(object_ids)
+            return len(object_ids)
+
     def _setup_schema(self):
-        """Set up the Weaviate schema for document chunks."""
+        """Set up the Weaviate schema for document chunks and cached query responses."""
+        if self._schema_ready:
+            return
+
         schema = {
             "classes": [{
                 "class": "Document",
                 "description": "A chunk of text from a SOX compliance document",
                 "vectorizer": "none",  # We'll provide our own vectors
+                "vectorIndexConfig": {
+                    "distance": "cosine",
+                    "pq": {
+                        "enabled": False,  # Enabled after import, see _maybe_enable_compression
+                        "segments": PQ_SEGMENTS,
+                        "trainingLimit": PQ_MIN_OBJECTS * 10
+                    }
+                },
                 "properties": [
                     {
                         "name": "content",
@@ -54,126 +287,432 @@ class DocumentProcessor:
                         "description": "Additional metadata about the chunk"
                     }
                 ]
+            }, {
+                "class": "QueryCache",
+                "description": "A previously answered query and its response",
+                "vectorizer": "none",
+                "properties": [
+                    {
+                        "name": "query",
+                        "dataType": ["text"],
+                        "description": "The original query text"
+                    },
+                    {
+                        "name": "response",
+                        "dataType": ["text"],
+                        "description": "The JSON-encoded query response"
+                    },
+                    {
+                        "name": "created_at",
+                        "dataType": ["number"],
+                        "description": "Unix time the response was cached"
+                    }
+                ]
             }]
         }
 
-        try:
-            self.client.schema.create(schema)
-        except weaviate.exceptions.UnexpectedStatusCodeException as e:
-            if "already exists" not in str(e):
-                raise
-            logger.info("Schema already exists")
-
-    def process_document(self, file_path: str, source_name: str) -> List[Dict[str, Any]]:
-        """Process a document and split it into chunks."""
-        try:
-            chunks = self.doc_preprocessor.process_document(
-                open(file_path, 'rb').read(),
-                file_path
-            )
+        with _SCHEMA_LOCK:
+            for class_schema in schema["classes"]:
+                class_name = class_schema["class"]
+                if self.client.schema.exists(class_name):
+                    logger.info(f"Schema for {class_name} already exists")
+                    self._add_missing_properties(class_schema)
+                    continue
+
+                try:
+                    self.client.schema.create_class(class_schema)
+                except weaviate.exceptions.UnexpectedStatusCodeException:
+                    # Another worker process may have created it in the meantime
+                    if not self.client.schema.exists(class_name):
+                        raise
+
+        self._schema_ready = True
+
+    def _add_missing_properties(self, class_schema: Dict[str, Any]):
+        """Add properties introduced since an existing class was created."""
+        class_name = class_schema["class"]
+        existing = {
+            prop["name"] for prop in self.client.schema.get(class_name).get("properties", [])
+        }
+        for prop in class_schema["properties"]:
+            if prop["name"] not in existing:
+                self.client.schema.property.create(class_name, prop)
+                logger.info(f"Added property {prop['name']} to {class_name}")
 
-            processed_chunks = []
-            for chunk in chunks:
-                processed_chunk = {
+    def process_document(self, file: Union[str, BinaryIO], source_name: str) -> Iterator[Dict[str, Any]]:
+        """Process a document, given as a path or binary file object, and lazily yield its chunks."""
+        try:
+            # The preprocessor reads from the file, so it is never copied
+            for chunk in self.doc_preprocessor.process_document(file, source_name):
+                yield {
                     "content": chunk["content"],
                     "source": source_name,
                     "page": chunk["page"],
                     "chunk_type": chunk["type"],
                     "metadata": chunk["metadata"]
                 }
-                processed_chunks.append(processed_chunk)
-
-            return processed_chunks
         except Exception as e:
             logger.error(f"Error processing document {source_name}: {str(e)}")
             raise
 
-    def embed_and_store(self, chunks: List[Dict[str, Any]]):
-        """Embed text chunks and store them in Weaviate."""
-        batch = self.client.batch.configure(
-            batch_size=50,
-            dynamic=True,
-            timeout_retries=3
+    def _embed(self, texts: List[str]):
+        """Encode a list of texts into normalized embeddings in batched forward passes."""
+        return self.embedder.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
         )
 
+    def _embed_cached(self, texts: List[str], cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+        """Encode texts, reusing cached embeddings keyed by content hash."""
+        cache = cache or self.embedding_cache
+        keys = [EmbeddingCache.key(text) for text in texts]
+        cached = cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            embeddings = self._embed(list(missing.values()))
+            computed = dict(zip(missing.keys(), embeddings))
+            cache.put_many(computed)
+            cached.update(computed)
+
+        return np.stack([cached[key] for key in keys])
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Encode queries, reusing embeddings from the in-memory query cache."""
+        return self._embed_cached(queries, self.query_embedding_cache)
+
+    def _object_id(self, chunk: Dict[str, Any]) -> str:
+        """Return the Weaviate object id for a chunk, derived from its source, position, and content."""
+        key = "\x00".join([
+            chunk["source"],
+            str(chunk["page"]),
+            chunk["chunk_type"],
+            chunk["content"]
+        ])
+        return generate_uuid5(hashlib.sha256(key.encode()).hexdigest())
+
+    def _record_batch_results(self, results: Optional[List[Dict[str, Any]]]):
+        """Batch callback recording which objects Weaviate stored and logging the failures."""
+        for result in results or []:
+            errors = result.get("result", {}).get("errors")
+            if errors:
+                logger.error(f"Error storing object {result.get('id')} in Weaviate: {errors}")
+            else:
+                self._batch_stored_ids.add(result["id"])
+
+    def embed_and_store(self, chunks: Iterable[Dict[str, Any]]) -> int:
+        """Embed text chunks and store them in Weaviate, skipping already stored content.
+
+        Chunks are consumed in sub-batches, so a streamed document is never held
+        in memory whole. Returns the number of chunks read.
+        """
+        chunks = iter(chunks)
+        total = 0
+        skipped = 0
+        stored_total = 0
+
         try:
-            with batch:
-                for chunk in chunks:
-                    # Generate embedding for the chunk
-                    embedding = self.embedder.encode(chunk["content"]).tolist()
-
-                    # Prepare metadata
-                    metadata = chunk["metadata"]
-                    metadata.update({
-                        "embedding_model": "all-MiniLM-L6-v2",
-                        "chunk_type": chunk["chunk_type"]
-                    })
-
-                    # Store in Weaviate
-                    self.client.batch.add_data_object(
-                        data_object={
-                            "content": chunk["content"],
-                            "source": chunk["source"],
-                            "page": chunk["page"],
-                            "chunk_type": chunk["chunk_type"],
-                            "metadata": metadata
-                        },
-                        class_name="Document",
-                        vector=embedding
-                    )
+            while True:
+                sub_batch = list(islice(chunks, EMBED_SUB_BATCH_SIZE))
+                if not sub_batch:
+                    break
+                total += len(sub_batch)
+
+                # The same chunk of the same document maps to the same object id, so
+                # re-uploads are skipped before embedding and any that slip through
+                # are idempotent upserts. Content shared between documents gets an
+                # object per document and is only encoded once, via the embedding cache.
+                new_chunks = {}
+                for chunk in sub_batch:
+                    object_id = self._object_id(chunk)
+                    if object_id not in self._index_id_set:
+                        new_chunks.setdefault(object_id, chunk)
+
+                skipped += len(sub_batch) - len(new_chunks)
+                if not new_chunks:
+                    continue
+
+                sub_batch_ids = list(new_chunks.keys())
+                sub_batch = list(new_chunks.values())
+
+                # Generate embeddings for the whole sub-batch in one pass
+                embeddings = self._embed_cached([chunk["content"] for chunk in sub_batch])
+
+                with self._batch_lock:
+                    self._batch_stored_ids = set()
+                    with self.client.batch as batch:
+                        for chunk, embedding, object_id in zip(sub_batch, embeddings, sub_batch_ids):
+                            # Prepare metadata
+                            metadata = chunk["metadata"]
+                            metadata.update({
+                                "embedding_model": "all-MiniLM-L6-v2",
+                                "chunk_type": chunk["chunk_type"]
+                            })
+
+                            # Store in Weaviate
+                            batch.add_data_object(
+                                data_object={
+                                    "content": chunk["content"],
+                                    "source": chunk["source"],
+                                    "page": chunk["page"],
+                                    "chunk_type": chunk["chunk_type"],
+                                    "metadata": metadata
+                                },
+                                class_name="Document",
+                                uuid=object_id,
+                                vector=embedding.tolist()
+                            )
+
+                    stored = [
+                        i for i, object_id in enumerate(sub_batch_ids)
+                        if object_id in self._batch_stored_ids
+                    ]
+
+                # Only index what Weaviate confirmed, so failed chunks are retried on re-upload
+                failed = len(sub_batch) - len(stored)
+                if failed:
+                    logger.error(f"Weaviate did not store {failed} of {len(sub_batch)} chunks")
+                self._add_to_vector_index(embeddings[stored], [sub_batch_ids[i] for i in stored])
+                stored_total += len(stored)
+                with self._stats_lock:
+                    self._chunk_count += len(stored)
+                    self._type_counts.update(sub_batch[i]["chunk_type"] for i in stored)
         except Exception as e:
             logger.error(f"Error storing chunks in Weaviate: {str(e)}")
             raise
+        finally:
+            # Answers cached before these chunks existed may now be incomplete
+            if stored_total:
+                self.invalidate_cached_responses()
+
+        if skipped:
+            logger.info(f"Skipped {skipped} chunks that are already stored")
+
+        self._maybe_enable_compression()
+        return total
+
+    def _maybe_enable_compression(self):
+        """Enable product quantization once enough vectors exist to train the codebook."""
+        if self._compression_enabled:
+            return
+
+        # Only ask Weaviate once this process counts enough chunks to train on
+        count = self._chunk_count
+        if count < PQ_MIN_OBJECTS:
+            return
+
+        try:
+            config = self.client.schema.get("Document")["vectorIndexConfig"]
+            if config.get("pq", {}).get("enabled"):
+                self._compression_enabled = True
+                return
+
+            self.client.schema.update_config("Document", {
+                "vectorIndexConfig": {
+                    "pq": {
+                        "enabled": True,
+                        "segments": PQ_SEGMENTS,
+                        "trainingLimit": PQ_MIN_OBJECTS * 10
+                    }
+                }
+            })
+            self._compression_enabled = True
+            logger.info(f"Enabled product quantization for {count} document chunks")
+        except Exception as e:
+            logger.error(f"Error enabling vector compression: {str(e)}")
 
     def query_similar(self, query: str, limit: int = 5) -> List[Dict[str, Any]]:
         """Query similar documents based on the input query."""
+        return self.query_similar_batch([query], limit)[0]
+
+    def query_similar_batch(self, queries: List[str], limit: int = 5) -> List[List[Dict[str, Any]]]:
+        """Query similar documents for several queries with one embedding pass and one request."""
+        try:
+            unique_queries = list(dict.fromkeys(queries))
+            query_embeddings = self.embed_queries(unique_queries)
+
+            matches = self._search_vector_index(query_embeddings, limit)
+            if matches is None:
+                matches = self._search_weaviate(query_embeddings, limit)
+
+            by_query = dict(zip(unique_queries, matches))
+            return [by_query[query] for query in queries]
+        except Exception as e:
+            logger.error(f"Error querying similar documents: {str(e)}")
+            raise
+
+    def _search_vector_index(
+        self,
+        query_embeddings: np.ndarray,
+        limit: int
+    ) -> Optional[List[List[Dict[str, Any]]]]:
+        """Search the local vector index, returning None if it holds no chunks yet."""
+        with self._index_lock:
+            count = self.vector_index.get_current_count()
+            if count == 0:
+                return None
+
+            labels, distances = self.vector_index.knn_query(
+                query_embeddings,
+                k=min(limit, count)
+            )
+            id_lists = [
+                [
+                    self._index_ids[label]
+                    for label, distance in zip(row_labels, row_distances)
+                    if distance <= MAX_COSINE_DISTANCE
+                ]
+                for row_labels, row_distances in zip(labels, distances)
+            ]
+
+        # Weaviate remains the source of truth for chunk content
+        chunks = self._fetch_chunks({object_id for ids in id_lists for object_id in ids})
+        return [
+            [chunks[object_id] for object_id in ids if object_id in chunks]
+            for ids in id_lists
+        ]
+
+    def _search_weaviate(
+        self,
+        query_embeddings: np.ndarray,
+        limit: int
+    ) -> List[List[Dict[str, Any]]]:
+        """Search Weaviate directly with one nearVector sub-query per embedding."""
+        result = self.client.query.multi_get([
+            self.client.query
+            .get("Document", DOCUMENT_FIELDS)
+            .with_near_vector({
+                "vector": query_embedding.tolist(),
+                "certainty": 0.7
+            })
+            .with_limit(limit)
+            .with_alias(f"query{i}")
+            for i, query_embedding in enumerate(query_embeddings)
+        ]).do()
+
+        matches = result.get("data", {}).get("Get", {})
+        return [matches.get(f"query{i}") or [] for i in range(len(query_embeddings))]
+
+    def _fetch_chunks(self, object_ids) -> Dict[str, Dict[str, Any]]:
+        """Fetch document chunks from Weaviate by object id, in bounded pages."""
+        object_ids = list(object_ids)
+        chunks = {}
+        for start in range(0, len(object_ids), FETCH_PAGE_SIZE):
+            operands = [
+                {"path": ["id"], "operator": "Equal", "valueText": object_id}
+                for object_id in object_ids[start:start + FETCH_PAGE_SIZE]
+            ]
+            where = operands[0] if len(operands) == 1 else {"operator": "Or", "operands": operands}
+
+            result = (
+                self.client.query
+                .get("Document", DOCUMENT_FIELDS)
+                .with_additional(["id"])
+                .with_where(where)
+                .with_limit(len(operands))
+                .do()
+            )
+
+            for chunk in result.get("data", {}).get("Get", {}).get("Document", []):
+                chunks[chunk.pop("_additional")["id"]] = chunk
+        return chunks
+
+    def get_cached_response(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return a previous response for a semantically equivalent query, if any."""
         try:
-            query_embedding = self.embedder.encode(query).tolist()
+            query_embedding = self.embed_queries([query])[0].tolist()
+            # Skip answers that expired or predate the latest upload
+            min_created_at = max(time.time() - QUERY_CACHE_TTL_SECONDS, self._corpus_updated_at)
 
             result = (
                 self.client.query
-                .get("Document", [
-                    "content",
-                    "source",
-                    "page",
-                    "chunk_type",
-                    "metadata"
-                ])
+                .get("QueryCache", ["response"])
                 .with_near_vector({
                     "vector": query_embedding,
-                    "certainty": 0.7
+                    "distance": 1.0 - QUERY_CACHE_MIN_SIMILARITY
                 })
-                .with_limit(limit)
+                .with_where({
+                    "path": ["created_at"],
+                    "operator": "GreaterThanEqual",
+                    "valueNumber": min_created_at
+                })
+                .with_limit(1)
                 .do()
             )
 
-            return result.get("data", {}).get("Get", {}).get("Document", [])
+            hits = result.get("data", {}).get("Get", {}).get("QueryCache", [])
+            return json.loads(hits[0]["response"]) if hits else None
         except Exception as e:
-            logger.error(f"Error querying similar documents: {str(e)}")
-            raise
+            logger.error(f"Error looking up cached response: {str(e)}")
+            return None
 
-    async def process_uploaded_file(self, file_content: bytes, filename: str):
-        """Process an uploaded file."""
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(filename).suffix) as tmp:
-            tmp.write(file_content)
-            tmp_path = tmp.name
+    def cache_response(self, query: str, response: Dict[str, Any], retrieved_at: Optional[float] = None):
+        """Store a query response so semantically equivalent queries can reuse it.
 
+        The entry is dated from when its context was retrieved, so an answer that
+        raced an upload is treated as predating it.
+        """
         try:
-            # Process the document
-            chunks = self.doc_preprocessor.process_document(file_content, filename)
+            self.client.data_object.create(
+                data_object={
+                    "query": query,
+                    "response": json.dumps(response),
+                    "created_at": retrieved_at or time.time()
+                },
+                class_name="QueryCache",
+                vector=self.embed_queries([query])[0].tolist()
+            )
+        except Exception as e:
+            logger.error(f"Error caching query response: {str(e)}")
+
+    def invalidate_cached_responses(self):
+        """Drop every cached answer after new chunks were stored."""
+        self._corpus_updated_at = time.time()
+        self._delete_cached_responses(self._corpus_updated_at)
 
-            # Embed and store chunks
-            self.embed_and_store(chunks)
+    def expire_cached_responses(self):
+        """Delete cached answers older than the cache TTL."""
+        self._delete_cached_responses(time.time() - QUERY_CACHE_TTL_SECONDS)
 
-            return len(chunks)
+    def _delete_cached_responses(self, created_before: float):
+        """Delete cached answers created before the given Unix time."""
+        try:
+            self.client.batch.delete_objects(
+                class_name="QueryCache",
+                where={
+                    "path": ["created_at"],
+                    "operator": "LessThan",
+                    "valueNumber": created_before
+                }
+            )
+        except Exception as e:
+            logger.error(f"Error deleting cached responses: {str(e)}")
+
+    async def process_uploaded_file(self, file: BinaryIO, filename: str):
+        """Process an uploaded file from its spooled file object."""
+        try:
+            # Parsing, embedding, and storing block, so run them off the event loop
+            return await run_blocking(self._process_file, file, filename)
         except Exception as e:
             logger.error(f"Error processing uploaded file {filename}: {str(e)}")
             raise
-        finally:
-            os.unlink(tmp_path)
 
-    def get_document_statistics(self) -> Dict[str, Any]:
-        """Get statistics about processed documents."""
+    def _process_file(self, file: Union[str, BinaryIO], filename: str) -> int:
+        """Process a file, embed and store its chunks, and return the chunk count."""
+        # Stream the document's chunks, attributed to the uploaded file name,
+        # straight into embedding and storage
+        chunks = self.process_document(file, filename)
+        return self.embed_and_store(chunks)
+
+    def refresh_document_statistics(self):
+        """Reload the cached statistics from Weaviate aggregates."""
         try:
             result = (
                 self.client.query
@@ -194,10 +733,22 @@ class DocumentProcessor:
                 .do()
             )
 
+            with self._stats_lock:
+                self._chunk_count = total_chunks
+                self._type_counts = Counter({
+                    group["groupedBy"]["value"]: group["meta"]["count"]
+                    for group in type_distribution["data"]["Aggregate"]["Document"]
+                })
+        except Exception as e:
+            logger.error(f"Error refreshing document statistics: {str(e)}")
+
+    def get_document_statistics(self) -> Dict[str, Any]:
+        """Get statistics about processed documents from the in-process cache."""
+        with self._stats_lock:
             return {
-                "total_chunks": total_chunks,
-                "chunk_type_distribution": type_distribution["data"]["Aggregate"]["Document"]
+                "total_chunks": self._chunk_count,
+                "chunk_type_distribution": [
+                    {"groupedBy": {"value": chunk_type}, "meta": {"count": count}}
+                    for chunk_type, count in self._type_counts.items()
+                ]
             }
-        except Exception as e:
-            logger.error(f"Error getting document statistics: {str(e)}")
-            raise
@@ -1,8 +1,11 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import os
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
-from .document_processor import DocumentProcessor
+import asyncio
+import time
+import httpx
+import numpy as np
+from sentence_transformers import CrossEncoder
+from .document_processor import DocumentProcessor, run_blocking
 from ..utils.query_classifier import QueryClassifier, QueryType, QueryComplexity
 import logging
 import json
@@ -10,6 +13,41 @@ import json
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# OpenAI-compatible completions server (vLLM) hosting the LLM
+LLM_API_URL = os.getenv("LLM_API_URL", "http://localhost:8001/v1")
+LLM_MODEL = os.getenv("LLM_MODEL", "mistralai/Mistral-7B-Instruct-v0.1")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+# Generations a batch request keeps in flight at once
+LLM_BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+
+# Generated token budget by query complexity
+MAX_NEW_TOKENS = {
+    'simple': 200,
+    'moderate': 400,
+    'complex': 700,
+    'expert': 1000
+}
+# Stop sequences that cut off the model starting a new question
+STOP_SEQUENCES = ["\n\nQuestion:"]
+
+# Candidates pulled from the vector index before cross-encoder re-ranking
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_BATCH_SIZE = 32
+
+# Reference confidence weights by chunk type and query complexity
+REFERENCE_BASE_CONFIDENCE = 0.7
+REFERENCE_TYPE_WEIGHTS = {
+    'text': 1.0,
+    'table': 0.9,
+    'annotation': 0.8
+}
+REFERENCE_COMPLEXITY_WEIGHTS = {
+    'simple': 1.0,
+    'moderate': 0.9,
+    'complex': 0.8,
+    'expert': 0.7
+}
+
 SYSTEM_PROMPT = """You are an AI assistant specialized in SOX (Sarbanes-Oxley Act) compliance.
 Your task is to provide accurate, clear, and concise answers to questions about SOX compliance documents.
 Base your answers strictly on the provided context. If you're unsure or the information isn't in the context, say so.
@@ -23,25 +61,23 @@ Consider the query type and complexity level provided, and adjust your response
 
 Format your response in a clear, structured manner using markdown when appropriate."""
 
+NO_CONTEXT_ANSWER = "I couldn't find any relevant information in the SOX compliance documents to answer your question."
+
 class QueryService:
     def __init__(self, doc_processor: DocumentProcessor):
-        """Initialize the query service with document processor and LLM."""
+        """Initialize the query service with document processor and LLM client."""
         self.doc_processor = doc_processor
-        self.query_classifier = QueryClassifier()
+        # Queries are typed with the retrieval model, whose embeddings retrieval then reuses
+        self.query_classifier = QueryClassifier(embed=doc_processor.embed_queries)
+        self.reranker = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
 
-        # Initialize Mistral model and tokenizer
-        self.model = AutoModelForCausalLM.from_pretrained(
-            "mistralai/Mistral-7B-Instruct-v0.1",
-            torch_dtype=torch.float16,
-            device_map="auto"
-        )
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "mistralai/Mistral-7B-Instruct-v0.1"
-        )
+        # The model runs in a separate vLLM server with continuous batching
+        self.llm_client = httpx.AsyncClient(base_url=LLM_API_URL, timeout=LLM_TIMEOUT)
+        logger.info(f"Using LLM server: {LLM_API_URL} ({LLM_MODEL})")
 
-        # Set device
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {self.device}")
+    async def aclose(self):
+        """Close the connection pool to the LLM server."""
+        await self.llm_client.aclose()
 
     def _format_prompt(
         self,
@@ -49,7 +85,12 @@ class QueryService:
         contexts: List[Dict[str, Any]],
         query_analysis: Dict[str, Any]
     ) -> str:
-        """Format the prompt with system message, context, and query."""
+        """
+        Format the prompt with system message, context, and query.
+
+        Sections are ordered from most to least stable so the LLM server's prefix
+        cache can reuse the system prompt and any identical retrieved context.
+        """
         # Format context sections by type
         context_sections = {
             'text': [],
@@ -57,7 +98,13 @@ class QueryService:
             'annotation': []
         }
 
-        for ctx in contexts:
+        # Sort so identical retrieval sets always produce identical prompt text
+        ordered_contexts = sorted(
+            contexts,
+            key=lambda ctx: (ctx['source'], ctx['page'], ctx['content'])
+        )
+
+        for ctx in ordered_contexts:
             chunk_type = ctx.get('chunk_type', 'text')
             context_sections[chunk_type].append(
                 f"Document: {ctx['source']}, Page: {ctx['page']}\n{ctx['content']}"
@@ -79,141 +126,355 @@ Temporal Context: {json.dumps(query_analysis['temporal_context'])}
 
         prompt = f"""{SYSTEM_PROMPT}
 
-QUERY ANALYSIS:
-{query_context}
-
 CONTEXT:
 {context_str}
 
+QUERY ANALYSIS:
+{query_context}
+
 Question: {query}
 
 Answer: Let me help you with that based on the SOX compliance documents provided."""
 
         return prompt
 
+    def _rerank(
+        self,
+        query: str,
+        contexts: List[Dict[str, Any]],
+        top_k: int
+    ) -> List[Dict[str, Any]]:
+        """Re-rank retrieved contexts with the cross-encoder and keep the best top_k."""
+        if not contexts:
+            return contexts
+
+        scores = self.reranker.predict(
+            [(query, ctx['content']) for ctx in contexts],
+            batch_size=RERANK_BATCH_SIZE,
+            show_progress_bar=False
+        )
+        ranked = sorted(zip(scores, contexts), key=lambda pair: pair[0], reverse=True)
+        return [ctx for _, ctx in ranked[:top_k]]
+
     def _format_references(
         self,
         contexts: List[Dict[str, Any]],
         query_analysis: Dict[str, Any]
     ) -> List[Dict[str, Any]]:
         """Format the reference sources for citation."""
+        confidences = self._calculate_reference_confidences(contexts, query_analysis)
+
         references = []
-        for ctx in contexts:
+        for ctx, confidence in zip(contexts, confidences):
             reference = {
                 "document": ctx["source"],
                 "page": ctx["page"],
                 "excerpt": ctx["content"][:200] + "...",  # First 200 chars as preview
                 "relevance_type": ctx.get("chunk_type", "text"),
-                "confidence": self._calculate_reference_confidence(
-                    ctx,
-                    query_analysis
-                )
+                "confidence": float(confidence)
             }
             references.append(reference)
         return references
 
-    def _calculate_reference_confidence(
+    def _calculate_reference_confidences(
         self,
-        context: Dict[str, Any],
+        contexts: List[Dict[str, Any]],
         query_analysis: Dict[str, Any]
-    ) -> float:
-        """Calculate confidence score for a reference based on context and query analysis."""
-        base_confidence = 0.7
-
+    ) -> np.ndarray:
+        """Calculate confidence scores for all references based on chunk type and query complexity."""
         # Adjust based on chunk type
-        type_weights = {
-            'text': 1.0,
-            'table': 0.9,
-            'annotation': 0.8
-        }
-        type_factor = type_weights.get(context.get('chunk_type', 'text'), 0.7)
+        type_factors = np.array(
+            [REFERENCE_TYPE_WEIGHTS.get(ctx.get('chunk_type', 'text'), 0.7) for ctx in contexts],
+            dtype=np.float32
+        )
 
         # Adjust based on query complexity
-        complexity_weights = {
-            'simple': 1.0,
-            'moderate': 0.9,
-            'complex': 0.8,
-            'expert': 0.7
-        }
-        complexity_factor = complexity_weights.get(
+        complexity_factor = REFERENCE_COMPLEXITY_WEIGHTS.get(
             query_analysis['complexity'],
             0.7
         )
 
-        # Calculate final confidence
-        confidence = base_confidence * type_factor * complexity_factor
+        # Calculate final confidences
+        confidences = type_factors * (REFERENCE_BASE_CONFIDENCE * complexity_factor)
 
-        return min(1.0, max(0.0, confidence))
+        return np.clip(confidences, 0.0, 1.0)
 
-    def generate_response(self, prompt: str) -> str:
-        """Generate a response using the LLM."""
-        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+    def _completion_request(
+        self,
+        prompt: str,
+        max_tokens: int,
+        stream: bool = False
+    ) -> Dict[str, Any]:
+        """Build the completions request body for the LLM server."""
+        return {
+            "model": LLM_MODEL,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "stop": STOP_SEQUENCES,
+            "stream": stream
+        }
 
-        with torch.no_grad():
-            outputs = self.model.generate(
-                inputs["input_ids"],
-                max_length=2048,
-                temperature=0.7,
-                top_p=0.95,
-                do_sample=True,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+    def _max_new_tokens(self, query_analysis: Dict[str, Any]) -> int:
+        """Determine the generated token budget based on complexity."""
+        return MAX_NEW_TOKENS.get(query_analysis['complexity'], 512)
+
+    async def generate_response(self, prompt: str, max_tokens: int = 512) -> str:
+        """Generate a response using the LLM server."""
+        response = await self.llm_client.post(
+            "/completions",
+            json=self._completion_request(prompt, max_tokens)
+        )
+        response.raise_for_status()
+
+        # The completion holds only the generated answer, not the prompt
+        return response.json()["choices"][0]["text"].strip()
+
+    async def stream_response(self, prompt: str, max_tokens: int = 512) -> AsyncIterator[str]:
+        """Generate a response using the LLM server, yielding text as it is produced."""
+        async with self.llm_client.stream(
+            "POST",
+            "/completions",
+            json=self._completion_request(prompt, max_tokens, stream=True)
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)["choices"][0]["text"]
+
+    def _num_contexts(self, query_analysis: Dict[str, Any]) -> int:
+        """Determine number of contexts based on complexity."""
+        return {
+            'simple': 3,
+            'moderate': 5,
+            'complex': 7,
+            'expert': 10
+        }.get(query_analysis['complexity'], 5)
+
+    def _build_result(
+        self,
+        answer: str,
+        relevant_docs: List[Dict[str, Any]],
+        query_analysis: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Combine the generated answer with its sources and overall confidence."""
+        # Format sources for reference
+        sources = self._format_references(relevant_docs, query_analysis)
+
+        # Calculate overall confidence
+        confidence = min(
+            query_analysis['confidence_score'],
+            sum(s['confidence'] for s in sources) / len(sources)
+        )
 
-        response = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-        # Extract the answer part after "Answer: "
-        return response.split("Answer: ")[-1].strip()
+        return {
+            "answer": answer,
+            "sources": sources,
+            "confidence": confidence,
+            "query_analysis": query_analysis
+        }
+
+    async def _answer_query(
+        self,
+        query: str,
+        query_analysis: Dict[str, Any],
+        candidates: List[Dict[str, Any]],
+        retrieved_at: float
+    ) -> Dict[str, Any]:
+        """Re-rank retrieved candidates, generate the answer, and cache the response."""
+        # Keep the best candidates by cross-encoder score
+        relevant_docs = await run_blocking(
+            self._rerank,
+            query,
+            candidates,
+            self._num_contexts(query_analysis)
+        )
+
+        if not relevant_docs:
+            return {
+                "answer": NO_CONTEXT_ANSWER,
+                "sources": [],
+                "confidence": 0.0,
+                "query_analysis": query_analysis
+            }
+
+        # Format prompt with context
+        prompt = self._format_prompt(query, relevant_docs, query_analysis)
+
+        # Generate response
+        response = await self.generate_response(
+            prompt,
+            self._max_new_tokens(query_analysis)
+        )
+
+        result = self._build_result(response, relevant_docs, query_analysis)
+        await run_blocking(self.doc_processor.cache_response, query, result, retrieved_at)
+
+        return result
 
     async def process_query(self, query: str) -> Dict[str, Any]:
         """Process a query and return the response with sources."""
         try:
+            # Reuse the answer to a semantically equivalent query
+            cached_response = await run_blocking(
+                self.doc_processor.get_cached_response,
+                query
+            )
+            if cached_response is not None:
+                return cached_response
+
             # Analyze query
-            query_analysis = self.query_classifier.classify_query(query)
+            query_analysis = await run_blocking(
+                self.query_classifier.classify_query,
+                query
+            )
             logger.info(f"Query analysis: {json.dumps(query_analysis)}")
 
-            # Determine number of contexts based on complexity
-            num_contexts = {
-                'simple': 3,
-                'moderate': 5,
-                'complex': 7,
-                'expert': 10
-            }.get(query_analysis['complexity'], 5)
+            # Retrieve a wide candidate pool for re-ranking
+            retrieved_at = time.time()
+            candidates = await run_blocking(
+                self.doc_processor.query_similar,
+                query,
+                max(RERANK_CANDIDATES, self._num_contexts(query_analysis))
+            )
+
+            return await self._answer_query(query, query_analysis, candidates, retrieved_at)
+
+        except Exception as e:
+            logger.error(f"Error processing query: {str(e)}")
+            raise
+
+    async def process_queries(self, queries: List[str]) -> List[Dict[str, Any]]:
+        """Process several queries, sharing one embedding pass and one retrieval request."""
+        try:
+            unique_queries = list(dict.fromkeys(queries))
+
+            # Reuse the answers to semantically equivalent queries
+            cached_responses = await asyncio.gather(*(
+                run_blocking(self.doc_processor.get_cached_response, query)
+                for query in unique_queries
+            ))
+            results = {
+                query: cached
+                for query, cached in zip(unique_queries, cached_responses)
+                if cached is not None
+            }
+            pending = [query for query in unique_queries if query not in results]
+
+            if pending:
+                # Analyze queries
+                query_analyses = await run_blocking(
+                    self.query_classifier.classify_queries,
+                    pending
+                )
+
+                # Retrieve a wide candidate pool for every query at once
+                retrieved_at = time.time()
+                candidate_lists = await run_blocking(
+                    self.doc_processor.query_similar_batch,
+                    pending,
+                    max([RERANK_CANDIDATES] + [self._num_contexts(a) for a in query_analyses])
+                )
+
+                # The LLM server batches concurrent generations, up to a limit
+                # so one batch request can't crowd out every other query
+                semaphore = asyncio.Semaphore(LLM_BATCH_CONCURRENCY)
+
+                async def answer(query, query_analysis, candidates):
+                    async with semaphore:
+                        return await self._answer_query(
+                            query, query_analysis, candidates, retrieved_at
+                        )
 
-            # Retrieve relevant documents
-            relevant_docs = self.doc_processor.query_similar(
+                answers = await asyncio.gather(*(
+                    answer(query, query_analysis, candidates)
+                    for query, query_analysis, candidates
+                    in zip(pending, query_analyses, candidate_lists)
+                ))
+                results.update(zip(pending, answers))
+
+            return [results[query] for query in queries]
+
+        except Exception as e:
+            logger.error(f"Error processing queries: {str(e)}")
+            raise
+
+    async def stream_query(self, query: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process a query, yielding answer tokens as they are generated.
+
+        Yields {"token": ...} events followed by a final event carrying the
+        sources, confidence, and query analysis.
+        """
+        try:
+            # Reuse the answer to a semantically equivalent query
+            cached_response = await run_blocking(
+                self.doc_processor.get_cached_response,
+                query
+            )
+            if cached_response is not None:
+                yield {"token": cached_response["answer"]}
+                yield {
+                    "sources": cached_response["sources"],
+                    "confidence": cached_response["confidence"],
+                    "query_analysis": cached_response["query_analysis"]
+                }
+                return
+
+            # Analyze query
+            query_analysis = await run_blocking(
+                self.query_classifier.classify_query,
+                query
+            )
+            num_contexts = self._num_contexts(query_analysis)
+
+            # Retrieve a wide candidate pool and keep the best by cross-encoder score
+            retrieved_at = time.time()
+            candidates = await run_blocking(
+                self.doc_processor.query_similar,
+                query,
+                max(RERANK_CANDIDATES, num_contexts)
+            )
+            relevant_docs = await run_blocking(
+                self._rerank,
                 query,
-                limit=num_contexts
+                candidates,
+                num_contexts
             )
 
             if not relevant_docs:
-                return {
-                    "answer": "I couldn't find any relevant information in the SOX compliance documents to answer your question.",
+                yield {"token": NO_CONTEXT_ANSWER}
+                yield {
                     "sources": [],
                     "confidence": 0.0,
                     "query_analysis": query_analysis
                 }
+                return
 
-            # Format prompt with context
+            # Stream the generated response
             prompt = self._format_prompt(query, relevant_docs, query_analysis)
-
-            # Generate response
-            response = self.generate_response(prompt)
-
-            # Format sources for reference
-            sources = self._format_references(relevant_docs, query_analysis)
-
-            # Calculate overall confidence
-            confidence = min(
-                query_analysis['confidence_score'],
-                sum(s['confidence'] for s in sources) / len(sources)
-            )
-
-            return {
-                "answer": response,
-                "sources": sources,
-                "confidence": confidence,
+            tokens = []
+            async for token in self.stream_response(
+                prompt,
+                self._max_new_tokens(query_analysis)
+            ):
+                tokens.append(token)
+                yield {"token": token}
+
+            result = self._build_result("".join(tokens).strip(), relevant_docs, query_analysis)
+            await run_blocking(self.doc_processor.cache_response, query, result, retrieved_at)
+
+            yield {
+                "sources": result["sources"],
+                "confidence": result["confidence"],
                 "query_analysis": query_analysis
             }
 
         except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
+            logger.error(f"Error streaming query: {str(e)}")
             raise
@@ -2,6 +2,7 @@ import unittest
 from ..utils.document_preprocessor import DocumentPreprocessor
 import io
 import os
+import threading
 from PIL import Image
 import numpy as np
 import docx
@@ -57,17 +58,27 @@ class TestDocumentPreprocessor(unittest.TestCase):
     def test_chunk_text(self):
         """Test text chunking functionality."""
         test_text = "This is a test document. " * 50
-        chunks = self.preprocessor._chunk_text(test_text, chunk_size=100, overlap=20)
+        chunks = list(self.preprocessor._chunk_text(test_text, chunk_size=100, overlap=20))
 
         self.assertTrue(len(chunks) > 1)
         for chunk in chunks:
             self.assertLessEqual(len(chunk), 100)
 
-        # Test overlap
+        # Test overlap; chunks are stripped, so the next one drops any leading space
         if len(chunks) > 1:
-            overlap_text = chunks[0][-20:]
+            overlap_text = chunks[0][-20:].lstrip()
             self.assertTrue(chunks[1].startswith(overlap_text))
 
+    def test_chunk_text_makes_progress(self):
+        """Test chunking terminates when the overlap is larger than a word-aligned chunk."""
+        test_text = "x" * 150 + " " + "y" * 300
+        chunks = list(self.preprocessor._chunk_text(test_text, chunk_size=200, overlap=180))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertTrue(chunks[-1].endswith("y"))
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk), 200)
+
     def test_calculate_ocr_confidence(self):
         """Test OCR confidence calculation."""
         good_text = "This is a well-formatted text with proper spacing."
@@ -80,6 +91,37 @@ class TestDocumentPreprocessor(unittest.TestCase):
         self.assertGreaterEqual(good_confidence, 0.0)
         self.assertLessEqual(good_confidence, 1.0)
 
+    def test_ocr_confidence_error_counts(self):
+        """Test that each kind of OCR error lowers confidence by one per word."""
+        # One mixed digit/letter pair, one run of spaces, and one unusual character
+        text = "Scan 1a of the   report \u00e9 done now ok fine"
+        confidence = self.preprocessor._calculate_ocr_confidence(text)
+        self.assertAlmostEqual(confidence, 0.7)
+
+    def test_ocr_confidence_non_ascii_digits(self):
+        """Test that a non-ASCII digit is unusual and still starts a mixed digit/letter pair."""
+        # The Arabic-Indic three counts as an unusual character and, like \d, as a digit
+        confidence = self.preprocessor._calculate_ocr_confidence("Page \u0663a ok")
+        self.assertAlmostEqual(confidence, 1 / 3)
+
+    def test_ocr_error_counts_match_patterns(self):
+        """Test the character scan against the separate regex patterns on random text."""
+        import random
+        import re
+        from ..utils import document_preprocessor as module
+
+        patterns = [r'\d[a-zA-Z]', r'[^a-zA-Z0-9\s\.,;:\'\"!?\-()]', r'\s{3,}']
+        alphabet = "aZ19 \t.,#\u00e9\u00b2\u0663\u0966\u07c0\u3000\u2003x"
+        rng = random.Random(0)
+        for _ in range(2000):
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 20)))
+            codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+            counts = module._count_ocr_errors(
+                codes, module._CHAR_CLASSES, *module._wide_code_points()
+            )
+            expected = sum(len(re.findall(pattern, text)) for pattern in patterns)
+            self.assertEqual(sum(counts), expected, f"Failed for text: {text!r}")
+
     def test_is_table_block(self):
         """Test table detection in text blocks."""
         table_text = "| Header 1 | Header 2 |\n| Data 1 | Data 2 |"
@@ -88,15 +130,91 @@ class TestDocumentPreprocessor(unittest.TestCase):
         self.assertTrue(self.preprocessor._is_table_block((0, 0, 0, 0, table_text)))
         self.assertFalse(self.preprocessor._is_table_block((0, 0, 0, 0, non_table_text)))
 
+    def test_process_image(self):
+        """Test OCR processing and releasing the OCR engine."""
+        image_content = self.create_test_image()
+        with DocumentPreprocessor() as preprocessor:
+            chunks = preprocessor._process_image(image_content)
+            self.assertTrue(all(chunk['metadata']['source_type'] == 'ocr' for chunk in chunks))
+        self.assertEqual(preprocessor._ocr_apis, [])
+
+    def test_ocr_handle_per_thread(self):
+        """Test that each thread gets its own Tesseract handle and close() ends them all."""
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        from ..utils import document_preprocessor as module
+
+        with mock.patch.object(module, 'tesserocr') as fake_tesserocr:
+            fake_tesserocr.PyTessBaseAPI.side_effect = lambda: mock.MagicMock()
+            preprocessor = DocumentPreprocessor()
+            barrier = threading.Barrier(3)
+
+            def get_handles():
+                barrier.wait()
+                return preprocessor._get_ocr_api(), preprocessor._get_ocr_api()
+
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                results = list(executor.map(lambda _: get_handles(), range(3)))
+
+            self.assertTrue(all(first is second for first, second in results))
+            handles = [first for first, _ in results]
+            self.assertEqual(len({id(handle) for handle in handles}), 3)
+
+            preprocessor.close()
+            for handle in handles:
+                handle.End.assert_called_once()
+            self.assertEqual(preprocessor._ocr_apis, [])
+            self.assertIsNone(preprocessor._get_ocr_api())
+
     def test_process_pdf(self):
         """Test PDF processing."""
         pdf_content = self.create_test_pdf()
-        chunks = self.preprocessor._process_pdf(pdf_content)
+        chunks = list(self.preprocessor._process_pdf(pdf_content))
 
         self.assertTrue(len(chunks) > 0)
         self.assertTrue(any('SOX Compliance' in chunk['content'] for chunk in chunks))
         self.assertTrue(all(chunk['type'] in ['text', 'table', 'annotation'] for chunk in chunks))
 
+    def test_read_page_layout(self):
+        """Test that text derived from the page layout matches PyMuPDF's plain text."""
+        import fitz
+        with fitz.open(stream=self.create_test_pdf(), filetype="pdf") as doc:
+            page = doc[0]
+            text, blocks = self.preprocessor._read_page_layout(page)
+
+            self.assertEqual(text, page.get_text())
+            self.assertEqual(
+                [block[4] for block in blocks],
+                [block[4] for block in page.get_text("blocks") if block[6] == 0]
+            )
+
+    def test_process_pdf_is_streamed(self):
+        """Test that PDF chunks are produced lazily."""
+        pdf_content = self.create_test_pdf()
+        chunks = self.preprocessor._process_pdf(pdf_content)
+
+        self.assertFalse(isinstance(chunks, list))
+        first_chunk = next(chunks)
+        self.assertEqual(first_chunk['page'], 1)
+        chunks.close()
+
+    def test_process_pdf_from_spooled_upload(self):
+        """Test that PDF uploads spooled to an unnamed file are processed from a temporary path."""
+        import tempfile
+        from unittest import mock
+        from ..utils import document_preprocessor as module
+
+        pdf_content = self.create_test_pdf()
+        expected = [chunk['content'] for chunk in self.preprocessor._process_pdf(pdf_content)]
+
+        for max_bytes in [len(pdf_content), 0]:
+            with mock.patch.object(module, 'PDF_STREAM_MAX_BYTES', max_bytes):
+                with tempfile.SpooledTemporaryFile(max_size=1) as upload:
+                    upload.write(pdf_content)
+                    upload.seek(0)
+                    chunks = [chunk['content'] for chunk in self.preprocessor._process_pdf(upload)]
+            self.assertEqual(chunks, expected)
+
     def test_process_docx(self):
         """Test DOCX processing."""
         docx_content = self.create_test_docx()
@@ -110,18 +228,49 @@ class TestDocumentPreprocessor(unittest.TestCase):
         """Test overall document processing."""
         # Test PDF processing
         pdf_content = self.create_test_pdf()
-        pdf_chunks = self.preprocessor.process_document(pdf_content, 'test.pdf')
+        pdf_chunks = list(self.preprocessor.process_document(pdf_content, 'test.pdf'))
         self.assertTrue(len(pdf_chunks) > 0)
 
+        # Test processing from a path on disk
+        pdf_path = os.path.join(self.test_data_dir, 'test.pdf')
+        path_chunks = list(self.preprocessor.process_document(pdf_path, 'test.pdf'))
+        self.assertEqual(
+            [chunk['content'] for chunk in path_chunks],
+            [chunk['content'] for chunk in pdf_chunks]
+        )
+
+        # Test processing from an open file object
+        with open(pdf_path, 'rb') as f:
+            file_chunks = list(self.preprocessor.process_document(f, 'test.pdf'))
+        self.assertEqual(
+            [chunk['content'] for chunk in file_chunks],
+            [chunk['content'] for chunk in pdf_chunks]
+        )
+
         # Test DOCX processing
         docx_content = self.create_test_docx()
-        docx_chunks = self.preprocessor.process_document(docx_content, 'test.docx')
+        docx_chunks = list(self.preprocessor.process_document(docx_content, 'test.docx'))
         self.assertTrue(len(docx_chunks) > 0)
 
         # Test unsupported format
         with self.assertRaises(ValueError):
             self.preprocessor.process_document(b'test content', 'test.txt')
 
+    def test_process_documents(self):
+        """Test processing several documents in parallel."""
+        files = [
+            (self.create_test_pdf(), 'test.pdf'),
+            (self.create_test_docx(), 'test.docx')
+        ]
+        results = dict(self.preprocessor.process_documents(files, max_workers=2))
+
+        self.assertEqual(set(results.keys()), {'test.pdf', 'test.docx'})
+        self.assertEqual(
+            [chunk['content'] for chunk in results['test.pdf']],
+            [chunk['content'] for chunk in self.preprocessor.process_document(files[0][0], 'test.pdf')]
+        )
+        self.assertTrue(any('Control ID' in chunk['content'] for chunk in results['test.docx']))
+
     def test_extract_tables_from_pdf_page(self):
         """Test table extraction from PDF pages."""
         pdf_content = self.create_test_pdf()
@@ -138,9 +287,55 @@ class TestDocumentPreprocessor(unittest.TestCase):
             self.assertIsInstance(table, str)
             self.assertTrue(len(table) > 0)
 
+    def test_extract_tables_without_table_finder(self):
+        """Test the block heuristic is used when PyMuPDF has no table finder."""
+        class LegacyPage:
+            def get_text(self, option):
+                return [
+                    (0, 0, 10, 10, "| Control ID | Description |\n| IC-001 | Access |"),
+                    (0, 10, 10, 20, "Regular paragraph text.")
+                ]
+
+        tables = self.preprocessor._extract_tables_from_pdf_page(LegacyPage())
+        self.assertEqual(tables, ["| Control ID | Description | | IC-001 | Access |"])
+
+    def test_extract_tables_when_finder_finds_none(self):
+        """Test the block heuristic is used for borderless tables the table finder misses."""
+        class BorderlessPage:
+            number = 0
+
+            def get_drawings(self):
+                return [{"items": [("l", (0, 0), (10, 0))]}]
+
+            def find_tables(self):
+                return []
+
+            def get_text(self, option):
+                return [(0, 0, 10, 10, "| Control ID | Description |\n| IC-001 | Access |")]
+
+        tables = self.preprocessor._extract_tables_from_pdf_page(BorderlessPage())
+        self.assertEqual(tables, ["| Control ID | Description | | IC-001 | Access |"])
+
+    def test_table_finder_skipped_without_ruling_lines(self):
+        """Test that pages drawing no lines or rectangles skip the table finder."""
+        class TextPage:
+            number = 0
+
+            def get_drawings(self):
+                return [{"items": [("c", (0, 0), (1, 1), (2, 1), (3, 0))]}]
+
+            def find_tables(self):
+                raise AssertionError("find_tables should not run")
+
+            def get_text(self, option):
+                return [(0, 0, 10, 10, "Regular paragraph text.")]
+
+        self.assertEqual(self.preprocessor._extract_tables_from_pdf_page(TextPage()), [])
+
     def tearDown(self):
         """Clean up test files."""
         import shutil
+        self.preprocessor.close()
         if os.path.exists(self.test_data_dir):
             shutil.rmtree(self.test_data_dir)
 
@@ -0,0 +1,290 @@
+import unittest
+from unittest import mock
+from ..services import document_processor as module
+from ..services.document_processor import DocumentProcessor, EMBEDDING_DIM
+from ..utils.embedding_cache import EmbeddingCache
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+class FakeEncoder:
+    """Stand-in for the sentence encoder, giving each text a fixed random unit vector."""
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        vectors = np.stack([
+            np.random.default_rng(
+                int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+            ).standard_normal(EMBEDDING_DIM)
+            for text in texts
+        ]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+class FakeBatch:
+    """Stand-in for the Weaviate batch, reporting added objects to its callback on flush."""
+    def __init__(self):
+        self.callback = None
+        self.objects = {}
+        self.failing = set()
+        self.deleted = []
+        self._pending = []
+
+    def configure(self, callback=None, **kwargs):
+        self.callback = callback
+
+    def __enter__(self):
+        return self
+
+    def add_data_object(self, data_object, class_name, uuid=None, vector=None):
+        self._pending.append((uuid, data_object))
+
+    def __exit__(self, *exc_info):
+        results = []
+        for uuid, data_object in self._pending:
+            if uuid in self.failing:
+                results.append({"id": uuid, "result": {"errors": {"error": [{"message": "failed"}]}}})
+            else:
+                self.objects[uuid] = data_object
+                results.append({"id": uuid, "result": {}})
+        self._pending = []
+        self.callback(results)
+
+    def delete_objects(self, class_name, where):
+        self.deleted.append((class_name, where))
+
+def make_chunk(content, source="policy.pdf", page=1, chunk_type="text"):
+    """Build a chunk as the document preprocessor yields it."""
+    return {
+        "content": content,
+        "source": source,
+        "page": page,
+        "chunk_type": chunk_type,
+        "metadata": {}
+    }
+
+class TestDocumentProcessor(unittest.TestCase):
+    def setUp(self):
+        """Set up a processor on a mocked Weaviate client and a fake encoder."""
+        self.test_dir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.test_dir, 'index.bin')
+        self.client = mock.MagicMock()
+        self.client.batch = FakeBatch()
+        self.encoder = FakeEncoder()
+
+        self.patches = [
+            mock.patch.object(module.weaviate, 'Client', return_value=self.client),
+            mock.patch.object(module, 'SentenceTransformer', return_value=self.encoder),
+            mock.patch.object(module, 'DocumentPreprocessor'),
+            mock.patch.object(module, 'EMBEDDER_COMPILE', False),
+            mock.patch.object(module, 'EMBEDDING_CACHE_PATH', os.path.join(self.test_dir, 'cache.sqlite3')),
+            mock.patch.object(module, 'VECTOR_INDEX_PATH', self.index_path),
+            mock.patch.object(module, 'VECTOR_INDEX_INITIAL_CAPACITY', 2)
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.processor = DocumentProcessor()
+
+    def fetch_stored(self, object_ids):
+        """Serve chunks by id from what the fake batch stored."""
+        return {
+            object_id: self.client.batch.objects[object_id]
+            for object_id in object_ids
+            if object_id in self.client.batch.objects
+        }
+
+    def test_store_and_search_vector_index(self):
+        """Test that stored chunks are indexed locally and found by their own content."""
+        contents = [f"Control {i} is tested quarterly" for i in range(3)]
+        self.processor.embed_and_store([make_chunk(content) for content in contents])
+
+        # Three chunks outgrow the initial capacity of two
+        self.assertEqual(self.processor.vector_index.get_current_count(), 3)
+        self.assertGreaterEqual(self.processor.vector_index.get_max_elements(), 3)
+
+        with mock.patch.object(self.processor, '_fetch_chunks', side_effect=self.fetch_stored):
+            matches = self.processor._search_vector_index(
+                self.processor.embed_queries([contents[1]]),
+                limit=1
+            )
+        self.assertEqual([match['content'] for match in matches[0]], [contents[1]])
+
+    def test_search_empty_vector_index(self):
+        """Test that an empty local index defers the search to Weaviate."""
+        query_embeddings = self.processor.embed_queries(["audit scope"])
+        self.assertIsNone(self.processor._search_vector_index(query_embeddings, limit=5))
+
+    def test_vector_index_persistence(self):
+        """Test that a saved index and its id mapping are loaded by a new processor."""
+        self.processor.embed_and_store([make_chunk(f"Policy {i}") for i in range(3)])
+        self.processor.save_vector_index()
+
+        reloaded = DocumentProcessor()
+        self.assertEqual(reloaded._index_ids, self.processor._index_ids)
+        self.assertEqual(reloaded.vector_index.get_current_count(), 3)
+        reloaded.embedding_cache.close()
+
+    def test_sync_vector_index(self):
+        """Test that a sync indexes other replicas' chunks, invalidates cached answers, and saves."""
+        vectors = FakeEncoder().encode(["first", "second"])
+        query = self.client.query.get.return_value.with_additional.return_value.with_limit.return_value
+        query.do.return_value = {"data": {"Get": {"Document": [
+            {"_additional": {"id": f"00000000-0000-0000-0000-00000000000{i}", "vector": vector.tolist()}}
+            for i, vector in enumerate(vectors)
+        ]}}}
+        query.with_after.return_value.do.return_value = {"data": {"Get": {"Document": []}}}
+
+        self.processor._chunk_count = 2
+        self.processor.sync_vector_index()
+        self.assertEqual(self.processor.vector_index.get_current_count(), 2)
+        self.assertEqual(len(self.client.batch.deleted), 1)
+        self.assertTrue(os.path.exists(self.index_path))
+
+        # A sync that finds nothing new keeps the cached answers
+        self.processor._chunk_count = 3
+        self.processor.sync_vector_index()
+        self.assertEqual(self.processor.vector_index.get_current_count(), 2)
+        self.assertEqual(len(self.client.batch.deleted), 1)
+
+    def test_object_id(self):
+        """Test that object ids are stable and distinct per source, page, type, and content."""
+        chunk = make_chunk("Access reviews run monthly")
+        self.assertEqual(
+            self.processor._object_id(chunk),
+            self.processor._object_id(make_chunk("Access reviews run monthly"))
+        )
+
+        variants = [
+            make_chunk("Access reviews run quarterly"),
+            make_chunk("Access reviews run monthly", source="other.pdf"),
+            make_chunk("Access reviews run monthly", page=2),
+            make_chunk("Access reviews run monthly", chunk_type="table")
+        ]
+        ids = {self.processor._object_id(variant) for variant in variants}
+        self.assertEqual(len(ids), len(variants))
+        self.assertNotIn(self.processor._object_id(chunk), ids)
+
+    def test_embed_and_store_skips_stored_chunks(self):
+        """Test that re-uploaded chunks are skipped before embedding and storing."""
+        chunks = [make_chunk(f"Segregation of duties {i}") for i in range(3)]
+        self.assertEqual(self.processor.embed_and_store(chunks), 3)
+        encoded = len(self.encoder.encoded)
+
+        # A re-upload and a duplicate within it add nothing
+        chunks = [make_chunk(f"Segregation of duties {i}") for i in range(3)]
+        self.assertEqual(self.processor.embed_and_store(chunks + chunks[:1]), 4)
+        self.assertEqual(len(self.encoder.encoded), encoded)
+        self.assertEqual(len(self.client.batch.objects), 3)
+        self.assertEqual(self.processor.vector_index.get_current_count(), 3)
+        self.assertEqual(self.processor._chunk_count, 3)
+
+    def test_shared_content_stored_per_document(self):
+        """Test that content shared between documents is stored for each but encoded once."""
+        self.processor.embed_and_store([make_chunk("Shared boilerplate", source="a.pdf")])
+        self.processor.embed_and_store([make_chunk("Shared boilerplate", source="b.pdf")])
+
+        self.assertEqual(len(self.client.batch.objects), 2)
+        self.assertEqual(self.encoder.encoded, ["Shared boilerplate"])
+
+    def test_failed_objects_are_not_indexed(self):
+        """Test that chunks Weaviate rejects stay out of the index and are retried on re-upload."""
+        chunks = [make_chunk("Stored chunk"), make_chunk("Rejected chunk")]
+        rejected_id = self.processor._object_id(chunks[1])
+        self.client.batch.failing.add(rejected_id)
+
+        self.processor.embed_and_store(chunks)
+        self.assertNotIn(rejected_id, self.processor._index_id_set)
+        self.assertEqual(self.processor._chunk_count, 1)
+
+        self.client.batch.failing.clear()
+        self.processor.embed_and_store([make_chunk("Stored chunk"), make_chunk("Rejected chunk")])
+        self.assertIn(rejected_id, self.processor._index_id_set)
+        self.assertEqual(self.processor._chunk_count, 2)
+
+    def test_cached_response_expiry_and_invalidation(self):
+        """Test that lookups skip answers past the TTL or older than the latest upload."""
+        lookup = self.client.query.get.return_value.with_near_vector.return_value.with_where
+        lookup.return_value.with_limit.return_value.do.return_value = {
+            "data": {"Get": {"QueryCache": [{"response": json.dumps({"answer": "Yes"})}]}}
+        }
+
+        with mock.patch.object(module.time, 'time', return_value=10000.0):
+            self.assertEqual(self.processor.get_cached_response("Is SOX mandatory?"), {"answer": "Yes"})
+        self.assertEqual(
+            lookup.call_args[0][0]["valueNumber"],
+            10000.0 - module.QUERY_CACHE_TTL_SECONDS
+        )
+
+        # Storing new chunks drops every answer cached before them
+        with mock.patch.object(module.time, 'time', return_value=20000.0):
+            self.processor.embed_and_store([make_chunk("New retention policy")])
+        self.assertEqual(self.client.batch.deleted, [(
+            "QueryCache",
+            {"path": ["created_at"], "operator": "LessThan", "valueNumber": 20000.0}
+        )])
+        with mock.patch.object(module.time, 'time', return_value=20001.0):
+            self.processor.get_cached_response("Is SOX mandatory?")
+        self.assertEqual(lookup.call_args[0][0]["valueNumber"], 20000.0)
+
+        # Re-uploading stored chunks doesn't
+        self.processor.embed_and_store([make_chunk("New retention policy")])
+        self.assertEqual(len(self.client.batch.deleted), 1)
+
+    def test_expire_cached_responses(self):
+        """Test that expiry deletes answers older than the TTL."""
+        with mock.patch.object(module.time, 'time', return_value=50000.0):
+            self.processor.expire_cached_responses()
+        self.assertEqual(self.client.batch.deleted, [(
+            "QueryCache",
+            {
+                "path": ["created_at"],
+                "operator": "LessThan",
+                "valueNumber": 50000.0 - module.QUERY_CACHE_TTL_SECONDS
+            }
+        )])
+
+    def test_cache_response_dated_from_retrieval(self):
+        """Test that cached answers are dated from when their context was retrieved."""
+        self.processor.cache_response("Who signs off?", {"answer": "The CFO"}, 123.0)
+
+        data_object = self.client.data_object.create.call_args.kwargs["data_object"]
+        self.assertEqual(data_object["created_at"], 123.0)
+        self.assertEqual(json.loads(data_object["response"]), {"answer": "The CFO"})
+
+    def test_query_embeddings_not_persisted(self):
+        """Test that query embeddings are cached in memory only."""
+        query = "Who approves journal entries?"
+        self.processor.embed_queries([query])
+
+        key = EmbeddingCache.key(query)
+        self.assertEqual(self.processor.embedding_cache.get_many([key]), {})
+        self.assertIn(key, self.processor.query_embedding_cache.get_many([key]))
+
+    def test_compression_enabled_once(self):
+        """Test that Weaviate's schema is only checked once enough chunks exist, and not after enabling."""
+        self.client.schema.get.reset_mock()
+        self.client.schema.get.return_value = {"vectorIndexConfig": {"pq": {"enabled": False}}}
+
+        self.processor._chunk_count = module.PQ_MIN_OBJECTS - 1
+        self.processor._maybe_enable_compression()
+        self.client.schema.get.assert_not_called()
+
+        self.processor._chunk_count = module.PQ_MIN_OBJECTS
+        self.processor._maybe_enable_compression()
+        self.processor._maybe_enable_compression()
+        self.client.schema.get.assert_called_once_with("Document")
+        self.client.schema.update_config.assert_called_once()
+
+    def tearDown(self):
+        """Clean up test files."""
+        import shutil
+        self.processor.embedding_cache.close()
+        for patch in self.patches:
+            patch.stop()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from ..utils.embedding_cache import EmbeddingCache
+import os
+import tempfile
+import numpy as np
+
+class TestEmbeddingCache(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.test_dir, 'cache.sqlite3')
+        self.cache = EmbeddingCache(self.cache_path, max_memory_items=2)
+
+    def test_key(self):
+        """Test that keys are stable SHA-256 digests of the text."""
+        self.assertEqual(EmbeddingCache.key("SOX"), EmbeddingCache.key("SOX"))
+        self.assertNotEqual(EmbeddingCache.key("SOX"), EmbeddingCache.key("sox"))
+        self.assertEqual(len(EmbeddingCache.key("SOX")), 32)
+
+    def test_put_and_get(self):
+        """Test round-tripping embeddings through the cache."""
+        key = EmbeddingCache.key("internal controls")
+        vector = np.random.rand(384).astype(np.float32)
+        self.cache.put_many({key: vector})
+
+        found = self.cache.get_many([key, EmbeddingCache.key("missing")])
+        self.assertEqual(list(found.keys()), [key])
+        np.testing.assert_array_equal(found[key], vector)
+
+    def test_persistence(self):
+        """Test that embeddings evicted from memory are still served from disk."""
+        vectors = {
+            EmbeddingCache.key(f"chunk {i}"): np.full(4, i, dtype=np.float32)
+            for i in range(5)
+        }
+        self.cache.put_many(vectors)
+        self.cache.close()
+
+        reopened = EmbeddingCache(self.cache_path)
+        found = reopened.get_many(vectors.keys())
+        self.assertEqual(len(found), 5)
+        for key, vector in vectors.items():
+            np.testing.assert_array_equal(found[key], vector)
+        reopened.close()
+
+    def test_memory_only(self):
+        """Test that a cache without a path drops evicted embeddings instead of persisting them."""
+        cache = EmbeddingCache(max_memory_items=2)
+        vectors = {
+            EmbeddingCache.key(f"query {i}"): np.full(4, i, dtype=np.float32)
+            for i in range(3)
+        }
+        cache.put_many(vectors)
+
+        found = cache.get_many(vectors.keys())
+        self.assertEqual(len(found), 2)
+        self.assertNotIn(EmbeddingCache.key("query 0"), found)
+        cache.close()
+
+    def tearDown(self):
+        """Clean up test files."""
+        import shutil
+        self.cache.close()
+        shutil.rmtree(self.test_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,38 +1,109 @@
 import unittest
-from ..utils.query_classifier import QueryClassifier, QueryType, QueryComplexity
+from ..utils.query_classifier import QueryClassifier, QueryType, QueryComplexity, _TYPE_DESCRIPTIONS
+import numpy as np
 import spacy
+from sentence_transformers import SentenceTransformer
+
+QUERY_TYPE_CASES = [
+    {
+        'query': "What are the basic SOX compliance requirements?",
+        'expected_type': QueryType.COMPLIANCE
+    },
+    {
+        'query': "When was the last review performed?",
+        'expected_type': QueryType.TEMPORAL
+    },
+    {
+        # Keyword rules take precedence over the prototypes
+        'query': "How do internal controls affect financial reporting?",
+        'expected_type': QueryType.COMPLIANCE
+    }
+]
+
+# Queries no keyword rule matches, typed by their closest prototype
+PROTOTYPE_CASES = {
+    "Why did revenue recognition differ between subsidiaries?": QueryType.ANALYTICAL,
+    "What are the steps to onboard a new vendor?": QueryType.PROCEDURAL
+}
+
+COMPLEXITY_CASES = [
+    {
+        'query': "What is SOX?",
+        'expected_complexity': QueryComplexity.SIMPLE
+    },
+    {
+        'query': "How are internal controls documented and tested?",
+        'expected_complexity': QueryComplexity.MODERATE
+    },
+    {
+        'query': "Compare the effectiveness of preventive and detective controls in our current framework.",
+        'expected_complexity': QueryComplexity.COMPLEX
+    },
+    {
+        'query': "Analyze the implications of implementing a new control framework on our existing compliance strategy and risk assessment methodology.",
+        'expected_complexity': QueryComplexity.EXPERT
+    }
+]
+
+TEMPORAL_CASES = [
+    {
+        'query': "What are the current control requirements?",
+        'expected_temporal': True
+    },
+    {
+        'query': "Show audit results from last quarter.",
+        'expected_temporal': True
+    },
+    {
+        'query': "List all controls.",
+        'expected_temporal': False
+    }
+]
+
+ENTITY_QUERY = "Review SOX compliance for Q2 2023 financial statements."
+AUGMENTATION_QUERY = "Analyze control effectiveness"
+
+BATCH_QUERIES = [
+    "What are the basic SOX compliance requirements?",
+    "When was the last audit performed?",
+    "Analyze the impact of recent control changes on our SOX compliance status for Q3 2023."
+]
 
 class TestQueryClassifier(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """Set up the classifier once for all tests."""
-        cls.classifier = QueryClassifier()
+        encoder = SentenceTransformer('all-MiniLM-L6-v2')
+        cls.classifier = QueryClassifier(embed=encoder.encode)
+
+        # Parse every query the tests use once, in a single batch
+        queries = list(dict.fromkeys(
+            [case['query'] for case in QUERY_TYPE_CASES + COMPLEXITY_CASES + TEMPORAL_CASES]
+            + [ENTITY_QUERY, AUGMENTATION_QUERY] + BATCH_QUERIES
+        ))
+        cls._docs = dict(zip(queries, cls.classifier.nlp.pipe(queries)))
+
+    def test_lazy_model_loading(self):
+        """Test that the spaCy model isn't loaded until it is needed."""
+        classifier = QueryClassifier()
+        self.assertNotIn('nlp', classifier.__dict__)
+
+        classifier.classify_query("   ")
+        self.assertNotIn('nlp', classifier.__dict__)
+
+    def test_pipeline_components(self):
+        """Test that only the spaCy components the classifier uses are loaded."""
+        self.assertIn('parser', self.classifier.nlp.pipe_names)
+        self.assertIn('ner', self.classifier.nlp.pipe_names)
+        self.assertNotIn('tagger', self.classifier.nlp.pipe_names)
+        self.assertNotIn('lemmatizer', self.classifier.nlp.pipe_names)
 
     def test_query_type_classification(self):
         """Test different types of query classification."""
-        test_cases = [
-            {
-                'query': "What are the basic SOX compliance requirements?",
-                'expected_type': QueryType.COMPLIANCE
-            },
-            {
-                'query': "When was the last audit performed?",
-                'expected_type': QueryType.TEMPORAL
-            },
-            {
-                'query': "How do internal controls affect financial reporting?",
-                'expected_type': QueryType.ANALYTICAL
-            },
-            {
-                'query': "What is the process for documenting control changes?",
-                'expected_type': QueryType.PROCEDURAL
-            }
-        ]
-
-        for case in test_cases:
+        for case in QUERY_TYPE_CASES:
             result = self.classifier._determine_query_type(
                 case['query'],
-                self.classifier.nlp(case['query'])
+                self._docs[case['query']]
             )
             self.assertEqual(
                 result,
@@ -40,31 +111,94 @@ class TestQueryClassifier(unittest.TestCase):
                 f"Failed for query: {case['query']}"
             )
 
+    def test_rule_based_type_without_doc(self):
+        """Test that keyword rules decide the query type without a parsed doc."""
+        self.assertEqual(
+            self.classifier._determine_query_type("What are the SOX requirements?"),
+            QueryType.COMPLIANCE
+        )
+        self.assertEqual(
+            self.classifier._determine_query_type("What is the deadline?"),
+            QueryType.TEMPORAL
+        )
+
+    def test_prototype_query_type(self):
+        """Test that untyped queries take their closest prototype's type, embedded in one call."""
+        labels = {description: query_type for query_type, description in _TYPE_DESCRIPTIONS.items()}
+        labels.update(PROTOTYPE_CASES)
+        calls = []
+
+        def embed(texts):
+            calls.append(list(texts))
+            # One-hot vectors put each text exactly on its type's prototype
+            return np.eye(len(QueryType))[[labels[text] for text in texts]]
+
+        classifier = QueryClassifier(embed=embed)
+        queries = list(PROTOTYPE_CASES) + ["What are the basic SOX compliance requirements?"]
+        results = classifier.classify_queries(queries)
+
+        self.assertEqual(
+            [result['query_type'] for result in results],
+            ['analytical', 'procedural', 'compliance']
+        )
+        # One call for the untyped queries and one for the prototypes
+        self.assertEqual(calls, [list(PROTOTYPE_CASES), list(_TYPE_DESCRIPTIONS.values())])
+
+    def test_default_type_without_encoder(self):
+        """Test that queries no keyword rule matches default to factual without an encoder."""
+        classifier = QueryClassifier()
+        self.assertEqual(
+            classifier._determine_query_type("What are the steps to onboard a new vendor?"),
+            QueryType.FACTUAL
+        )
+        self.assertEqual(
+            classifier._determine_query_type("What is the SOX deadline?"),
+            QueryType.COMPLIANCE
+        )
+
+    def test_keyword_inflections(self):
+        """Test that keyword rules match words starting with a keyword in any case."""
+        for query in [
+            "Which POLICY owners were updated?",
+            "Who is auditing the auditors?",
+            "Comparing preventive controlling activities",
+            "Which accounts are controlled?"
+        ]:
+            self.assertEqual(
+                self.classifier._determine_query_type(query),
+                QueryType.COMPLIANCE,
+                f"Failed for query: {query}"
+            )
+        self.assertEqual(
+            self.classifier._determine_query_type("Show the upcoming Deadlines"),
+            QueryType.TEMPORAL
+        )
+
+        query = "Assessing risk assessment gaps"
+        self.assertEqual(
+            self.classifier._assess_complexity(query, self.classifier.nlp(query)),
+            QueryComplexity.COMPLEX
+        )
+
+    def test_case_insensitive_keywords(self):
+        """Test that keyword rules give the same result regardless of case."""
+        query = "Compare the impact of the audit schedule"
+        for variant in [query, query.upper()]:
+            self.assertEqual(self.classifier._determine_query_type(variant), QueryType.COMPLIANCE)
+            context = self.classifier._identify_temporal_context(
+                variant, self.classifier.nlp(variant)
+            )
+            self.assertEqual(
+                [reference['text'] for reference in context['temporal_references']][:1],
+                [variant.split()[-1]]
+            )
+
     def test_complexity_assessment(self):
         """Test complexity assessment of different queries."""
-        test_cases = [
-            {
-                'query': "What is SOX?",
-                'expected_complexity': QueryComplexity.SIMPLE
-            },
-            {
-                'query': "How are internal controls documented and tested?",
-                'expected_complexity': QueryComplexity.MODERATE
-            },
-            {
-                'query': "Compare the effectiveness of preventive and detective controls in our current framework.",
-                'expected_complexity': QueryComplexity.COMPLEX
-            },
-            {
-                'query': "Analyze the implications of implementing a new control framework on our existing compliance strategy and risk assessment methodology.",
-                'expected_complexity': QueryComplexity.EXPERT
-            }
-        ]
-
-        for case in test_cases:
+        for case in COMPLEXITY_CASES:
             result = self.classifier._assess_complexity(
                 case['query'],
-                self.classifier.nlp(case['query'])
+                self._docs[case['query']]
             )
             self.assertEqual(
                 result,
@@ -74,8 +208,7 @@ class TestQueryClassifier(unittest.TestCase):
 
     def test_entity_extraction(self):
         """Test named entity extraction from queries."""
-        query = "Review SOX compliance for Q2 2023 financial statements."
-        doc = self.classifier.nlp(query)
+        doc = self._docs[ENTITY_QUERY]
         entities = self.classifier._extract_entities(doc)
 
         self.assertTrue(len(entities) > 0)
@@ -84,23 +217,8 @@ class TestQueryClassifier(unittest.TestCase):
 
     def test_temporal_context(self):
         """Test temporal context identification."""
-        test_cases = [
-            {
-                'query': "What are the current control requirements?",
-                'expected_temporal': True
-            },
-            {
-                'query': "Show audit results from last quarter.",
-                'expected_temporal': True
-            },
-            {
-                'query': "List all controls.",
-                'expected_temporal': False
-            }
-        ]
-
-        for case in test_cases:
-            doc = self.classifier.nlp(case['query'])
+        for case in TEMPORAL_CASES:
+            doc = self._docs[case['query']]
             result = self.classifier._identify_temporal_context(case['query'], doc)
             self.assertEqual(
                 result['has_temporal_aspect'],
@@ -110,8 +228,8 @@ class TestQueryClassifier(unittest.TestCase):
 
     def test_augmentation_suggestions(self):
         """Test query augmentation suggestions generation."""
-        query = "Analyze control effectiveness"
-        doc = self.classifier.nlp(query)
+        query = AUGMENTATION_QUERY
+        doc = self._docs[query]
         query_type = self.classifier._determine_query_type(query, doc)
         complexity = self.classifier._assess_complexity(query, doc)
         entities = self.classifier._extract_entities(doc)
@@ -173,16 +291,47 @@ class TestQueryClassifier(unittest.TestCase):
         self.assertIn('augmentation_suggestions', result)
         self.assertIn('confidence_score', result)
 
+        self.assertIn(
+            result['query_type'],
+            ['factual', 'analytical', 'compliance', 'procedural', 'temporal']
+        )
+        self.assertIn(result['complexity'], ['simple', 'moderate', 'complex', 'expert'])
         self.assertTrue(isinstance(result['entities'], list))
         self.assertTrue(isinstance(result['augmentation_suggestions'], list))
         self.assertTrue(0 <= result['confidence_score'] <= 1)
 
+    def test_batch_query_classification(self):
+        """Test that batched classification matches classifying queries one at a time."""
+        results = self.classifier.classify_queries(BATCH_QUERIES, batch_size=2)
+
+        self.assertEqual(len(results), len(BATCH_QUERIES))
+        for query, result in zip(BATCH_QUERIES, results):
+            single_result = self.classifier._classify_doc(query, self._docs[query])
+            self.assertEqual(result['query_type'], single_result['query_type'])
+            self.assertEqual(result['complexity'], single_result['complexity'])
+            self.assertEqual(result['entities'], single_result['entities'])
+
+    def test_classification_cache(self):
+        """Test that repeated queries are served from the cache as independent copies."""
+        query = "What are the basic SOX compliance requirements?"
+        first = self.classifier.classify_query(query)
+        first['augmentation_suggestions'].append("mutated")
+
+        second = self.classifier.classify_query(query)
+        self.assertIn(query, self.classifier._cache)
+        self.assertNotIn("mutated", second['augmentation_suggestions'])
+        self.assertIsNot(first, second)
+
     def test_edge_cases(self):
         """Test edge cases and potential error conditions."""
         # Empty query
         empty_result = self.classifier.classify_query("")
         self.assertTrue(empty_result['confidence_score'] < 0.5)
 
+        whitespace_result = self.classifier.classify_query("   ")
+        self.assertEqual(whitespace_result['entities'], [])
+        self.assertTrue(whitespace_result['confidence_score'] < 0.5)
+
         # Very long query
         long_query = "What is the impact of " + "control " * 100
         long_result = self.classifier.classify_query(long_query)
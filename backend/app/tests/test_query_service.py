@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+from ..services import query_service as module
+from ..services.query_service import QueryService
+import asyncio
+
+def make_context(content, chunk_type="text"):
+    """Build a retrieved chunk as the document processor returns it."""
+    return {
+        "content": content,
+        "source": "policy.pdf",
+        "page": 1,
+        "chunk_type": chunk_type,
+        "metadata": {}
+    }
+
+class TestQueryService(unittest.TestCase):
+    def setUp(self):
+        """Set up a query service on a mocked document processor and cross-encoder."""
+        self.reranker = mock.MagicMock()
+        self.patch = mock.patch.object(module, 'CrossEncoder', return_value=self.reranker)
+        self.patch.start()
+        self.service = QueryService(mock.MagicMock())
+
+    def test_rerank(self):
+        """Test that contexts are ordered by cross-encoder score and cut to top_k."""
+        contexts = [make_context(f"Chunk {i}") for i in range(4)]
+        self.reranker.predict.return_value = [0.1, 0.9, 0.4, 0.7]
+
+        ranked = self.service._rerank("Who reviews access?", contexts, 2)
+
+        self.assertEqual([ctx["content"] for ctx in ranked], ["Chunk 1", "Chunk 3"])
+        pairs = self.reranker.predict.call_args[0][0]
+        self.assertEqual(pairs, [("Who reviews access?", f"Chunk {i}") for i in range(4)])
+
+    def test_rerank_without_contexts(self):
+        """Test that re-ranking nothing skips the cross-encoder."""
+        self.assertEqual(self.service._rerank("Who reviews access?", [], 3), [])
+        self.reranker.predict.assert_not_called()
+
+    def test_reference_confidences(self):
+        """Test that vectorized confidences match the per-reference formula."""
+        contexts = [
+            make_context("Narrative", "text"),
+            make_context("Matrix", "table"),
+            make_context("Comment", "annotation"),
+            make_context("Unknown", "figure"),
+            {"content": "Untyped", "source": "policy.pdf", "page": 2}
+        ]
+        type_factors = [1.0, 0.9, 0.8, 0.7, 1.0]
+
+        for complexity, complexity_factor in [
+            ('simple', 1.0), ('moderate', 0.9), ('complex', 0.8), ('expert', 0.7), ('unknown', 0.7)
+        ]:
+            confidences = self.service._calculate_reference_confidences(
+                contexts, {'complexity': complexity}
+            )
+            for confidence, type_factor in zip(confidences, type_factors):
+                self.assertAlmostEqual(
+                    float(confidence),
+                    0.7 * type_factor * complexity_factor,
+                    places=6
+                )
+
+    def test_format_references(self):
+        """Test that references carry their confidences as plain floats."""
+        references = self.service._format_references(
+            [make_context("Matrix", "table")],
+            {'complexity': 'simple'}
+        )
+        self.assertEqual(references[0]["relevance_type"], "table")
+        self.assertIsInstance(references[0]["confidence"], float)
+        self.assertAlmostEqual(references[0]["confidence"], 0.63, places=6)
+
+    def tearDown(self):
+        """Close the LLM client and restore the cross-encoder."""
+        asyncio.run(self.service.aclose())
+        self.patch.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,15 +2,114 @@ import pytesseract
 from PIL import Image
 import pandas as pd
 import io
+import os
+import sys
+import shutil
+import tempfile
+import threading
 import fitz  # PyMuPDF
 import docx2txt
-import re
-from typing import List, Dict, Any, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
+from numba import njit
+from threadpoolctl import threadpool_limits
+from typing import List, Dict, Any, BinaryIO, Iterable, Iterator, Optional, Tuple, Union
 import logging
 
+try:
+    # In-process Tesseract bindings, which keep the engine loaded between images
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Largest PDF file object opened from memory; Starlette keeps uploads up to
+# this size in memory and rolls larger ones over to an unnamed temporary file
+PDF_STREAM_MAX_BYTES = 1024 * 1024
+
+# Character class flags for OCR error counting, indexed by code point below 256.
+# Together they mirror the patterns r'\d[a-zA-Z]' (mixed digits and letters),
+# r'[^a-zA-Z0-9\s\.,;:\'\"!?\-()]' (unusual characters) and r'\s{3,}' (multiple spaces).
+_CHAR_DIGIT = 1
+_CHAR_ALPHA = 2
+_CHAR_SPACE = 4
+_CHAR_UNUSUAL = 8
+_ALLOWED_PUNCTUATION = ".,;:'\"!?-()"
+
+def _build_char_classes() -> np.ndarray:
+    """Build the 256-entry lookup table of character classes."""
+    classes = np.zeros(256, dtype=np.uint8)
+    for code in range(256):
+        char = chr(code)
+        if '0' <= char <= '9':
+            classes[code] = _CHAR_DIGIT
+        elif char.isascii() and char.isalpha():
+            classes[code] = _CHAR_ALPHA
+        elif char.isspace():
+            classes[code] = _CHAR_SPACE
+        elif char not in _ALLOWED_PUNCTUATION:
+            classes[code] = _CHAR_UNUSUAL
+    return classes
+
+_CHAR_CLASSES = _build_char_classes()
+
+@lru_cache(maxsize=None)
+def _wide_code_points() -> Tuple[np.ndarray, np.ndarray]:
+    """Build the sorted whitespace and decimal digits above the lookup table, once per process."""
+    # Every other code point there is unusual. Non-ASCII digits are unusual too,
+    # but still match \d. Read from the running Python's Unicode database so they
+    # agree with its re module; built on first use as the scan takes ~0.1s.
+    spaces = [code for code in range(256, 0x3001) if chr(code).isspace()]
+    digits = [code for code in range(256, sys.maxunicode + 1) if chr(code).isdecimal()]
+    return np.array(spaces, dtype=np.uint32), np.array(digits, dtype=np.uint32)
+
+@njit(cache=True)
+def _contains(sorted_codes, code):
+    """Return whether a code point is in a sorted array of code points."""
+    i = np.searchsorted(sorted_codes, code)
+    return i < len(sorted_codes) and sorted_codes[i] == code
+
+@njit(cache=True)
+def _count_ocr_errors(codes, classes, wide_spaces, wide_digits):
+    """Count mixed digit/letter pairs, unusual characters, and runs of 3+ spaces in one pass."""
+    mixed = 0
+    unusual = 0
+    space_runs = 0
+    prev_digit = False
+    run = 0
+
+    for code in codes:
+        if code < 256:
+            char_class = classes[code]
+        elif _contains(wide_spaces, code):
+            char_class = _CHAR_SPACE
+        elif _contains(wide_digits, code):
+            char_class = _CHAR_DIGIT | _CHAR_UNUSUAL
+        else:
+            char_class = _CHAR_UNUSUAL
+
+        if char_class & _CHAR_SPACE:
+            run += 1
+        else:
+            if run >= 3:
+                space_runs += 1
+            run = 0
+
+        if char_class & _CHAR_ALPHA and prev_digit:
+            mixed += 1
+        if char_class & _CHAR_UNUSUAL:
+            unusual += 1
+        prev_digit = char_class & _CHAR_DIGIT != 0
+
+    if run >= 3:
+        space_runs += 1
+
+    return mixed, unusual, space_runs
+
 class DocumentPreprocessor:
     def __init__(self):
         self.supported_formats = {
@@ -21,8 +120,64 @@ class DocumentPreprocessor:
             'jpeg': self._process_image
         }
 
-    def process_document(self, file_content: bytes, filename: str) -> List[Dict[str, Any]]:
-        """Process document and extract content including tables and annotations."""
+        # Persistent Tesseract handle per thread, falling back to the pytesseract CLI
+        # wrapper. TessBaseAPI isn't thread-safe, so threads don't share a handle;
+        # every handle created is kept so close() can release them all.
+        self._use_tesserocr = tesserocr is not None
+        self._ocr_local = threading.local()
+        self._ocr_apis = []
+        self._ocr_apis_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the Tesseract handles."""
+        with self._ocr_apis_lock:
+            self._use_tesserocr = False
+            self._ocr_local = threading.local()
+            for api in self._ocr_apis:
+                api.End()
+            self._ocr_apis = []
+
+    def _get_ocr_api(self):
+        """Return this thread's Tesseract handle, or None to use pytesseract."""
+        api = getattr(self._ocr_local, 'api', None)
+        if api is not None or not self._use_tesserocr:
+            return api
+
+        try:
+            api = tesserocr.PyTessBaseAPI()
+        except RuntimeError as e:
+            logger.warning(f"Error initializing tesserocr, using pytesseract: {str(e)}")
+            self._use_tesserocr = False
+            return None
+
+        with self._ocr_apis_lock:
+            if not self._use_tesserocr:
+                # Closed while the handle was being created
+                api.End()
+                return None
+            self._ocr_apis.append(api)
+            self._ocr_local.api = api
+        return api
+
+    def process_document(self, file_content: Union[bytes, str, BinaryIO], filename: str) -> Iterable[Dict[str, Any]]:
+        """
+        Process document and extract content including tables and annotations.
+
+        Args:
+            file_content: The raw file bytes, a path to the file on disk, or a
+                binary file object positioned at the start of the file
+            filename: The original file name, used to detect the format
+
+        Returns:
+            The document's chunks. PDFs are streamed page by page, so wrap the
+            result in list() if it needs to be traversed more than once.
+        """
         file_ext = filename.split('.')[-1].lower()
 
         if file_ext not in self.supported_formats:
@@ -30,64 +185,136 @@ class DocumentPreprocessor:
 
         return self.supported_formats[file_ext](file_content)
 
-    def _process_pdf(self, content: bytes) -> List[Dict[str, Any]]:
-        """Process PDF files, extracting text, tables, and annotations."""
-        chunks = []
-        doc = fitz.open(stream=content, filetype="pdf")
-
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-
-            # Extract text
-            text = page.get_text()
-
-            # Extract tables
-            tables = self._extract_tables_from_pdf_page(page)
-
-            # Extract annotations
-            annotations = self._extract_annotations(page)
-
-            # Process text content
-            text_chunks = self._chunk_text(text)
-            for chunk in text_chunks:
-                chunks.append({
-                    'content': chunk,
-                    'type': 'text',
-                    'page': page_num + 1,
-                    'metadata': {'source_type': 'text'}
-                })
-
-            # Add tables
-            for table in tables:
-                chunks.append({
-                    'content': table,
-                    'type': 'table',
-                    'page': page_num + 1,
-                    'metadata': {'source_type': 'table'}
-                })
-
-            # Add annotations
-            for annotation in annotations:
-                chunks.append({
-                    'content': annotation,
-                    'type': 'annotation',
-                    'page': page_num + 1,
-                    'metadata': {'source_type': 'annotation'}
-                })
-
-        return chunks
-
-    def _process_docx(self, content: bytes) -> List[Dict[str, Any]]:
+    def process_documents(
+        self,
+        files: List[Tuple[Union[bytes, str], str]],
+        max_workers: Optional[int] = None
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        Process several documents in parallel worker processes.
+
+        Args:
+            files: (raw file bytes or path on disk, filename) pairs
+            max_workers: Number of worker processes, defaults to the CPU count
+
+        Yields:
+            (filename, chunks) pairs in the order the documents finish
+        """
+        # Inside a worker every core is already busy, so never nest pools
+        if _worker_preprocessor is not None or len(files) <= 1:
+            for file_content, filename in files:
+                yield filename, list(self.process_document(file_content, filename))
+            return
+
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            futures = [
+                executor.submit(_process_in_worker, file_content, filename)
+                for file_content, filename in files
+            ]
+            for future in as_completed(futures):
+                yield future.result()
+
+    def _open_source(self, content: Union[bytes, str, BinaryIO]):
+        """Return a path or file object for content given as a path, bytes, or file object."""
+        if isinstance(content, (bytes, bytearray)):
+            return io.BytesIO(content)
+        return content
+
+    @contextmanager
+    def _open_pdf(self, content: Union[bytes, str, BinaryIO]) -> Iterator[fitz.Document]:
+        """Open a PDF from a path, bytes, or file object without reading large files into memory."""
+        if isinstance(content, (bytes, bytearray)):
+            with fitz.open(stream=content, filetype="pdf") as doc:
+                yield doc
+            return
+
+        # Open files that already have a path on disk from there
+        if not isinstance(content, (str, os.PathLike)):
+            name = getattr(content, "name", None)
+            if isinstance(name, str) and os.path.isfile(name):
+                content = name
+
+        if isinstance(content, (str, os.PathLike)):
+            with fitz.open(content) as doc:
+                yield doc
+            return
+
+        start = content.tell()
+        size = content.seek(0, os.SEEK_END) - start
+        content.seek(start)
+        if size <= PDF_STREAM_MAX_BYTES:
+            # Small uploads are held in memory anyway
+            with fitz.open(stream=content.read(), filetype="pdf") as doc:
+                yield doc
+            return
+
+        # MuPDF only opens streams from memory, so give large ones a path instead
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            shutil.copyfileobj(content, pdf_file)
+            pdf_file.flush()
+            with fitz.open(pdf_file.name) as doc:
+                yield doc
+
+    def _process_pdf(self, content: Union[bytes, str, BinaryIO]) -> Iterator[Dict[str, Any]]:
+        """Process PDF files page by page, yielding text, table, and annotation chunks."""
+        with self._open_pdf(content) as doc:
+            for page_num in range(len(doc)):
+                page = doc[page_num]
+
+                # Extract text and text blocks from a single layout pass
+                text, blocks = self._read_page_layout(page)
+
+                # Extract tables
+                tables = self._extract_tables_from_pdf_page(page, blocks)
+
+                # Extract annotations
+                annotations = self._extract_annotations(page)
+
+                # Process text content
+                text_chunks = self._chunk_text(text)
+                for chunk in text_chunks:
+                    yield {
+                        'content': chunk,
+                        'type': 'text',
+                        'page': page_num + 1,
+                        'metadata': {'source_type': 'text'}
+                    }
+
+                # Add tables
+                for table in tables:
+                    yield {
+                        'content': table,
+                        'type': 'table',
+                        'page': page_num + 1,
+                        'metadata': {'source_type': 'table'}
+                    }
+
+                # Add annotations
+                for annotation in annotations:
+                    yield {
+                        'content': annotation,
+                        'type': 'annotation',
+                        'page': page_num + 1,
+                        'metadata': {'source_type': 'annotation'}
+                    }
+
+    def _process_docx(self, content: Union[bytes, str, BinaryIO]) -> List[Dict[str, Any]]:
         """Process DOCX files, extracting text and tables."""
-        text = docx2txt.process(io.BytesIO(content))
+        text = docx2txt.process(self._open_source(content))
         chunks = []
 
-        # Extract tables using regex patterns
-        table_pattern = r'\|.*\|'
-        tables = re.findall(table_pattern, text, re.MULTILINE)
-
-        # Remove tables from text
-        clean_text = re.sub(table_pattern, '', text, flags=re.MULTILINE)
+        # Split table rows (the span between the first and last '|' on a line)
+        # out of the text in a single pass
+        tables, body = [], []
+        for line in text.split('\n'):
+            first = line.find('|')
+            last = line.rfind('|')
+            if first != last:
+                tables.append(line[first:last + 1])
+                body.append(line[:first] + line[last + 1:])
+            else:
+                body.append(line)
+        clean_text = '\n'.join(body)
 
         # Process main text
         text_chunks = self._chunk_text(clean_text)
@@ -110,10 +337,15 @@ class DocumentPreprocessor:
 
         return chunks
 
-    def _process_image(self, content: bytes) -> List[Dict[str, Any]]:
+    def _process_image(self, content: Union[bytes, str, BinaryIO]) -> List[Dict[str, Any]]:
         """Process images using OCR."""
-        image = Image.open(io.BytesIO(content))
-        text = pytesseract.image_to_string(image)
+        image = Image.open(self._open_source(content))
+        ocr_api = self._get_ocr_api()
+        if ocr_api is None:
+            text = pytesseract.image_to_string(image)
+        else:
+            ocr_api.SetImage(image)
+            text = ocr_api.GetUTF8Text()
 
         chunks = []
         text_chunks = self._chunk_text(text)
@@ -131,11 +363,70 @@ class DocumentPreprocessor:
 
         return chunks
 
-    def _extract_tables_from_pdf_page(self, page) -> List[str]:
-        """Extract tables from PDF page."""
+    def _read_page_layout(self, page) -> Tuple[str, List[tuple]]:
+        """Read a PDF page's layout once, returning its text and its text blocks."""
+        layout = page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)
+
+        # Rebuild the (x0, y0, x1, y1, text) tuples of get_text("blocks"), whose
+        # concatenated text is what get_text() returns
+        blocks = []
+        for block in layout["blocks"]:
+            lines = block.get("lines")
+            if not lines:
+                continue
+            block_text = "".join(
+                "".join(span["text"] for span in line["spans"]) + "\n" for line in lines
+            )
+            x0, y0, x1, y1 = block["bbox"]
+            blocks.append((x0, y0, x1, y1, block_text))
+
+        text = "".join(block[4] for block in blocks)
+        return text, blocks
+
+    def _extract_tables_from_pdf_page(self, page, blocks: Optional[List[tuple]] = None) -> List[str]:
+        """Extract tables from PDF page, optionally reusing its already read text blocks."""
+        # PyMuPDF's table finder is pure Python and costs tens of milliseconds
+        # a page, so it only runs on pages with ruling lines to find tables by.
+        # The block heuristic covers the rest, versions without the finder,
+        # pages it can't handle, and borderless tables it misses.
+        if not hasattr(page, "find_tables") or not self._has_ruling_lines(page):
+            return self._extract_table_blocks(page, blocks)
+
+        try:
+            found = page.find_tables()
+        except Exception as e:
+            logger.warning(f"Error finding tables on page {page.number + 1}: {str(e)}")
+            return self._extract_table_blocks(page, blocks)
+
+        tables = []
+        for table in found:
+            table_text = self._format_table(table)
+            if table_text:
+                tables.append(table_text)
+        return tables or self._extract_table_blocks(page, blocks)
+
+    def _has_ruling_lines(self, page) -> bool:
+        """Check whether a PDF page draws any lines or rectangles."""
+        return any(
+            item[0] in ("l", "re")
+            for drawing in page.get_drawings()
+            for item in drawing["items"]
+        )
+
+    def _format_table(self, table) -> str:
+        """Format a table found by PyMuPDF into a string representation."""
+        if hasattr(table, "to_markdown"):
+            return table.to_markdown().strip()
+        return " ".join(
+            " ".join(cell or "" for cell in row) for row in table.extract()
+        ).strip()
+
+    def _extract_table_blocks(self, page, blocks: Optional[List[tuple]] = None) -> List[str]:
+        """Extract table-like text blocks from a PDF page using layout heuristics."""
         tables = []
         # Find table-like structures using layout analysis
-        blocks = page.get_text("blocks")
+        if blocks is None:
+            blocks = page.get_text("blocks")
         for block in blocks:
             if self._is_table_block(block):
                 table_text = self._format_table_block(block)
@@ -160,27 +451,26 @@ class DocumentPreprocessor:
         """Format table block into a string representation."""
         return block[4].replace('\n', ' ').strip()
 
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks."""
-        chunks = []
+    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> Iterator[str]:
+        """Split text into overlapping chunks, yielding each as it is cut."""
         start = 0
         text_length = len(text)
 
         while start < text_length:
-            end = start + chunk_size
-            chunk = text[start:end]
+            end = min(start + chunk_size, text_length)
 
             # Adjust chunk boundaries to not split words
             if end < text_length:
-                last_space = chunk.rfind(' ')
-                if last_space != -1:
-                    end = start + last_space
-                    chunk = text[start:end]
+                last_space = text.rfind(' ', start, end)
+                if last_space > start:
+                    end = last_space
 
-            chunks.append(chunk.strip())
-            start = end - overlap
+            yield text[start:end].strip()
 
-        return chunks
+            if end == text_length:
+                break
+            # Drop the overlap when it would reach back to or past this chunk's start
+            start = end - overlap if end - overlap > start else end
 
     def _calculate_ocr_confidence(self, text: str) -> float:
         """Calculate confidence score for OCR text."""
@@ -189,14 +479,27 @@ class DocumentPreprocessor:
         if not words:
             return 0.0
 
-        # Check for common OCR errors
-        error_patterns = [
-            r'\d[a-zA-Z]',  # Mixed digits and letters
-            r'[^a-zA-Z0-9\s\.,;:\'\"!?\-()]',  # Unusual characters
-            r'\s{3,}'  # Multiple spaces
-        ]
-
-        error_count = sum(1 for pattern in error_patterns for _ in re.finditer(pattern, text))
+        # Check for common OCR errors, one code point per array element
+        codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+        error_count = sum(_count_ocr_errors(codes, _CHAR_CLASSES, *_wide_code_points()))
         confidence = max(0.0, min(1.0, 1.0 - (error_count / len(words))))
 
         return confidence
+
+# Preprocessor owned by each process_documents worker process
+_worker_preprocessor = None
+
+def _init_worker():
+    """Set up a process_documents worker."""
+    global _worker_preprocessor
+    # One thread per worker for OpenMP-backed libraries so parallel files don't
+    # oversubscribe cores. libtesseract and numpy were loaded before the fork
+    # and read OMP_NUM_THREADS only then, so cap their pools directly; the
+    # variable still covers the tesseract processes pytesseract spawns.
+    threadpool_limits(limits=1)
+    os.environ["OMP_NUM_THREADS"] = "1"
+    _worker_preprocessor = DocumentPreprocessor()
+
+def _process_in_worker(file_content: Union[bytes, str], filename: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Process one document in a worker, materializing its chunks to send back."""
+    return filename, list(_worker_preprocessor.process_document(file_content, filename))
@@ -0,0 +1,102 @@
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+import numpy as np
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on bound parameters per statement
+_SQLITE_MAX_PARAMS = 900
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str] = None, max_memory_items: int = 10000):
+        """Initialize an in-memory LRU backed by an on-disk SQLite store of embeddings.
+
+        Without a path the cache is kept in memory only.
+        """
+        self._conn = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._conn.commit()
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self.max_memory_items = max_memory_items
+
+    @staticmethod
+    def key(text: str) -> bytes:
+        """Return the cache key for a text."""
+        return hashlib.sha256(text.encode()).digest()
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up embeddings, probing memory first and then disk."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+            if self._conn is None:
+                return found
+
+            for start in range(0, len(missing), _SQLITE_MAX_PARAMS):
+                batch = missing[start:start + _SQLITE_MAX_PARAMS]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN ({})".format(
+                        ",".join("?" * len(batch))
+                    ),
+                    batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+
+        return found
+
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        """Store embeddings as float32 bytes in memory and on disk."""
+        if not items:
+            return
+
+        with self._lock:
+            rows = []
+            for key, vector in items.items():
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+
+            if self._conn is None:
+                return
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        """Insert into the in-memory LRU, evicting the least recently used entries."""
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def close(self):
+        """Close the on-disk store."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
@@ -1,45 +1,107 @@
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import copy
 import re
-from enum import Enum
+from functools import cached_property
+import threading
+from enum import IntEnum
+import numpy as np
 import spacy
-from transformers import pipeline
+from spacy.tokens import Span
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class QueryType(Enum):
-    FACTUAL = "factual"  # Simple fact-based queries
-    ANALYTICAL = "analytical"  # Requires analysis of multiple sources
-    COMPLIANCE = "compliance"  # Specific compliance-related queries
-    PROCEDURAL = "procedural"  # Process or procedure-related queries
-    TEMPORAL = "temporal"  # Time-based or historical queries
-
-class QueryComplexity(Enum):
-    SIMPLE = "simple"  # Single-fact queries
-    MODERATE = "moderate"  # Multi-fact queries
-    COMPLEX = "complex"  # Analysis and synthesis required
-    EXPERT = "expert"  # Deep domain expertise required
+# spaCy pipeline components the classifier never reads from
+SPACY_EXCLUDED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer"]
+
+# spaCy entity labels that mark a temporal reference
+TEMPORAL_ENTITY_LABELS = ('DATE', 'TIME')
+
+# Number of classification results kept in the in-memory LRU
+CLASSIFICATION_CACHE_SIZE = 1024
+
+# Prefix regex over keyword last words, and each last word's keywords with their leading words
+KeywordGroup = Tuple["re.Pattern[str]", Dict[str, List[Tuple[str, Tuple[str, ...]]]]]
+
+class QueryType(IntEnum):
+    FACTUAL = 0  # Simple fact-based queries
+    ANALYTICAL = 1  # Requires analysis of multiple sources
+    COMPLIANCE = 2  # Specific compliance-related queries
+    PROCEDURAL = 3  # Process or procedure-related queries
+    TEMPORAL = 4  # Time-based or historical queries
+
+class QueryComplexity(IntEnum):
+    SIMPLE = 0  # Single-fact queries
+    MODERATE = 1  # Multi-fact queries
+    COMPLEX = 2  # Analysis and synthesis required
+    EXPERT = 3  # Deep domain expertise required
+
+# Names used for query types and complexities in classification results
+_QUERY_TYPE_STR = {
+    QueryType.FACTUAL: "factual",
+    QueryType.ANALYTICAL: "analytical",
+    QueryType.COMPLIANCE: "compliance",
+    QueryType.PROCEDURAL: "procedural",
+    QueryType.TEMPORAL: "temporal"
+}
+
+_COMPLEXITY_STR = {
+    QueryComplexity.SIMPLE: "simple",
+    QueryComplexity.MODERATE: "moderate",
+    QueryComplexity.COMPLEX: "complex",
+    QueryComplexity.EXPERT: "expert"
+}
+
+# Confidence adjustment per complexity, indexed by QueryComplexity
+_COMPLEXITY_FACTOR = (0.1, 0.05, -0.05, -0.1)
+
+# Example questions embedded as prototypes for queries no keyword rule matches
+_TYPE_DESCRIPTIONS = {
+    QueryType.FACTUAL: "What is the definition or value of a specific fact?",
+    QueryType.ANALYTICAL: "How does one factor affect another, and why do they differ?",
+    QueryType.COMPLIANCE: "Which regulatory requirements must we meet to stay compliant?",
+    QueryType.PROCEDURAL: "What are the steps of the process for carrying out this task?",
+    QueryType.TEMPORAL: "When did this happen, and how has it changed over time?"
+}
 
 class QueryClassifier:
-    def __init__(self):
-        """Initialize the query classifier with NLP models and patterns."""
-        # Load spaCy model for NLP tasks
+    def __init__(
+        self,
+        embed: Optional[Callable[[List[str]], np.ndarray]] = None,
+        cache_size: int = CLASSIFICATION_CACHE_SIZE
+    ):
+        """Initialize the query classifier's patterns; models load on first use.
+
+        embed encodes texts into sentence embeddings and types queries that no
+        keyword rule matches. Without it such queries default to factual.
+        """
+        self._embed = embed
+
+        # Initialize keyword patterns
+        self._init_patterns()
+
+        # LRU of classification results keyed by query string
+        self._cache: "OrderedDict[str, Dict[str, any]]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+    @cached_property
+    def nlp(self):
+        """spaCy model for NLP tasks, loaded on first use."""
+        # Only NER (doc.ents) and the dependency parser (token.dep_ == 'mark')
+        # are used, so the components that only produce POS tags and lemmas
+        # are excluded from the pipeline.
         try:
-            self.nlp = spacy.load("en_core_web_sm")
+            return spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDED_COMPONENTS)
         except OSError:
             import subprocess
             subprocess.run(["python", "-m", "spacy", "download", "en_core_web_sm"])
-            self.nlp = spacy.load("en_core_web_sm")
-
-        # Zero-shot classifier for query type
-        self.zero_shot = pipeline("zero-shot-classification")
-
-        # Initialize pattern matchers
-        self._init_patterns()
+            return spacy.load("en_core_web_sm", exclude=SPACY_EXCLUDED_COMPONENTS)
 
     def _init_patterns(self):
-        """Initialize regex patterns for query classification."""
+        """Initialize keyword patterns for query classification."""
         self.patterns = {
             'compliance_keywords': [
                 r'compliance', r'regulation', r'requirement', r'audit',
@@ -62,6 +124,68 @@ class QueryClassifier:
             }
         }
 
+        # Query types in prototype order
+        self._type_labels = list(QueryType)
+
+    # Compiled keyword groups, matched against lowercased tokens of the query
+    @cached_property
+    def _compliance_keywords(self) -> KeywordGroup:
+        return self._keyword_group(self.patterns['compliance_keywords'])
+
+    @cached_property
+    def _temporal_keywords(self) -> KeywordGroup:
+        return self._keyword_group(self.patterns['temporal_indicators'])
+
+    @cached_property
+    def _complex_keywords(self) -> KeywordGroup:
+        return self._keyword_group(self.patterns['complexity_indicators']['complex'])
+
+    @cached_property
+    def _expert_keywords(self) -> KeywordGroup:
+        return self._keyword_group(self.patterns['complexity_indicators']['expert'])
+
+    @cached_property
+    def _type_prototypes(self) -> np.ndarray:
+        """Normalized prototype embeddings for each query type, used when no keyword rule matches."""
+        prototypes = np.asarray(
+            self._embed([_TYPE_DESCRIPTIONS[qt] for qt in self._type_labels]),
+            dtype=np.float32
+        )
+        norms = np.linalg.norm(prototypes, axis=1, keepdims=True)
+        return prototypes / np.where(norms == 0, 1, norms)
+
+    def _keyword_group(self, keywords: List[str]) -> KeywordGroup:
+        """Compile keywords into one prefix regex over their last words.
+
+        The last word of a keyword matches any token it starts, so derived forms
+        like 'auditing', 'auditors' and 'assessment' match too. Leading words of
+        multi-word keywords must match the preceding tokens exactly.
+        """
+        leading_words = {}
+        for keyword in keywords:
+            *leading, last = keyword.split()
+            leading_words.setdefault(last, []).append((keyword, tuple(leading)))
+
+        # Longest first, so a last word that starts with another still matches whole
+        last_words = sorted(leading_words, key=len, reverse=True)
+        return re.compile("|".join(map(re.escape, last_words))), leading_words
+
+    def _match_keywords(self, group: KeywordGroup, doc) -> List[Tuple[str, Span]]:
+        """Return each keyword of a group found in the doc with the span it covers."""
+        regex, leading_words = group
+        matches = []
+        for token in doc:
+            found = regex.match(token.lower_)
+            if found is None:
+                continue
+            for keyword, leading in leading_words[found.group()]:
+                start = token.i - len(leading)
+                if start >= 0 and all(
+                    doc[start + i].lower_ == word for i, word in enumerate(leading)
+                ):
+                    matches.append((keyword, doc[start:token.i + 1]))
+        return matches
+
     def classify_query(self, query: str) -> Dict[str, any]:
         """
         Classify the query by type, complexity, and extract key characteristics.
@@ -72,11 +196,89 @@ class QueryClassifier:
         Returns:
             Dictionary containing query classification details
         """
-        # Process query with spaCy
-        doc = self.nlp(query)
+        return self.classify_queries([query])[0]
+
+    def classify_queries(
+        self,
+        queries: List[str],
+        batch_size: int = 64,
+        n_process: int = 1
+    ) -> List[Dict[str, any]]:
+        """
+        Classify several queries, parsing them with spaCy in batches.
+
+        Args:
+            queries: The input query strings
+            batch_size: Number of queries spaCy parses per batch
+            n_process: Number of processes spaCy parses with
+
+        Returns:
+            List of classification details, in the same order as the queries
+        """
+        # Serve repeated queries from the cache and only parse the misses
+        results = {}
+        with self._cache_lock:
+            for query in queries:
+                cached = self._cache.get(query)
+                if cached is not None:
+                    self._cache.move_to_end(query)
+                    results[query] = cached
+        missing = []
+        for query in dict.fromkeys(queries):
+            if query in results:
+                continue
+            if query.strip():
+                missing.append(query)
+            else:
+                # Blank queries carry nothing to parse
+                results[query] = self._classify_blank(query)
+
+        if missing:
+            docs = list(self.nlp.pipe(missing, batch_size=batch_size, n_process=n_process))
+            temporal_matches = [self._match_keywords(self._temporal_keywords, doc) for doc in docs]
+            query_types = [
+                self._keyword_query_type(doc, matches)
+                for doc, matches in zip(docs, temporal_matches)
+            ]
+
+            # Embed every query the keyword rules leave untyped in one call
+            untyped = [i for i, query_type in enumerate(query_types) if query_type is None]
+            if untyped:
+                prototype_types = self._prototype_query_types([missing[i] for i in untyped])
+                for i, query_type in zip(untyped, prototype_types):
+                    query_types[i] = query_type
+
+            classified = {
+                query: self._classify_doc(query, doc, matches, query_type)
+                for query, doc, matches, query_type
+                in zip(missing, docs, temporal_matches, query_types)
+            }
+            results.update(classified)
+            with self._cache_lock:
+                for query, result in classified.items():
+                    self._cache[query] = result
+                    self._cache.move_to_end(query)
+                while len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+
+        # Hand out copies so callers can't mutate cached results
+        return [copy.deepcopy(results[query]) for query in queries]
+
+    def _classify_doc(
+        self,
+        query: str,
+        doc,
+        temporal_matches: Optional[List[Tuple[str, Span]]] = None,
+        query_type: Optional[QueryType] = None
+    ) -> Dict[str, any]:
+        """Classify a query that has already been parsed with spaCy."""
+        # Temporal keywords both decide the type and are reported, so find them once
+        if temporal_matches is None:
+            temporal_matches = self._match_keywords(self._temporal_keywords, doc)
 
         # Determine query type
-        query_type = self._determine_query_type(query, doc)
+        if query_type is None:
+            query_type = self._determine_query_type(query, doc, temporal_matches)
 
         # Assess complexity
         complexity = self._assess_complexity(query, doc)
@@ -85,7 +287,7 @@ class QueryClassifier:
         entities = self._extract_entities(doc)
 
         # Identify temporal aspects
-        temporal_context = self._identify_temporal_context(query, doc)
+        temporal_context = self._identify_temporal_context(query, doc, temporal_matches)
 
         # Generate query augmentation suggestions
         augmentation = self._generate_augmentation_suggestions(
@@ -93,8 +295,8 @@ class QueryClassifier:
         )
 
         return {
-            'query_type': query_type.value,
-            'complexity': complexity.value,
+            'query_type': _QUERY_TYPE_STR[query_type],
+            'complexity': _COMPLEXITY_STR[complexity],
             'entities': entities,
             'temporal_context': temporal_context,
             'augmentation_suggestions': augmentation,
@@ -103,43 +305,90 @@ class QueryClassifier:
             )
         }
 
-    def _determine_query_type(self, query: str, doc) -> QueryType:
+    def _classify_blank(self, query: str) -> Dict[str, any]:
+        """Return a low-confidence default classification for an empty query."""
+        return {
+            'query_type': _QUERY_TYPE_STR[QueryType.FACTUAL],
+            'complexity': _COMPLEXITY_STR[QueryComplexity.SIMPLE],
+            'entities': [],
+            'temporal_context': {
+                'has_temporal_aspect': False,
+                'temporal_type': None,
+                'temporal_references': []
+            },
+            'augmentation_suggestions': self._generate_augmentation_suggestions(
+                query, QueryType.FACTUAL, QueryComplexity.SIMPLE, []
+            ),
+            'confidence_score': 0.0
+        }
+
+    def _determine_query_type(
+        self,
+        query: str,
+        doc=None,
+        temporal_matches: Optional[List[Tuple[str, Span]]] = None
+    ) -> QueryType:
         """Determine the type of query using multiple classification approaches."""
-        # Use zero-shot classification for query type
-        candidate_labels = [qt.value for qt in QueryType]
-        result = self.zero_shot(
-            query,
-            candidate_labels,
-            hypothesis_template="This is a {} question."
-        )
+        # Keyword rules only need tokens, so don't run the pipeline for them
+        if doc is None:
+            doc = self.nlp.make_doc(query)
 
-        # Get the highest scoring label
-        primary_type = QueryType(result['labels'][0])
+        query_type = self._keyword_query_type(doc, temporal_matches)
+        if query_type is None:
+            query_type = self._prototype_query_types([query])[0]
+        return query_type
 
+    def _keyword_query_type(
+        self,
+        doc,
+        temporal_matches: Optional[List[Tuple[str, Span]]] = None
+    ) -> Optional[QueryType]:
+        """Type a query by its keywords, or return None if no keyword rule matches."""
         # Check for compliance-specific patterns
-        if any(re.search(pattern, query.lower())
-              for pattern in self.patterns['compliance_keywords']):
+        if self._match_keywords(self._compliance_keywords, doc):
             return QueryType.COMPLIANCE
 
         # Check for temporal patterns
-        if any(re.search(pattern, query.lower())
-              for pattern in self.patterns['temporal_indicators']):
+        if temporal_matches is None:
+            temporal_matches = self._match_keywords(self._temporal_keywords, doc)
+        if temporal_matches:
             return QueryType.TEMPORAL
 
-        return primary_type
+        return None
+
+    def _prototype_query_types(self, queries: List[str]) -> List[QueryType]:
+        """Type queries by the closest type prototype, embedding them in one call."""
+        # spaCy's small model has no static word vectors to compare, so without
+        # a sentence encoder there is nothing better than the default
+        if self._embed is None:
+            return [QueryType.FACTUAL] * len(queries)
+
+        # Closest prototype by cosine similarity; a zero vector scores 0 against
+        # every prototype and so falls to the first, factual
+        vectors = np.asarray(self._embed(queries), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        similarities = (vectors / np.where(norms == 0, 1, norms)) @ self._type_prototypes.T
+        return [self._type_labels[int(i)] for i in np.argmax(similarities, axis=1)]
 
     def _assess_complexity(self, query: str, doc) -> QueryComplexity:
         """Assess the complexity of the query."""
-        # Count relevant features
-        num_entities = len([ent for ent in doc.ents])
-        num_clauses = len([token for token in doc if token.dep_ == 'mark'])
-        word_count = len([token for token in doc if not token.is_punct])
-
-        # Check for complexity indicators
-        complex_indicators = sum(1 for pattern in self.patterns['complexity_indicators']['complex']
-                               if re.search(pattern, query.lower()))
-        expert_indicators = sum(1 for pattern in self.patterns['complexity_indicators']['expert']
-                               if re.search(pattern, query.lower()))
+        # Count relevant features in a single pass over the tokens
+        num_entities = len(doc.ents)
+        num_clauses = 0
+        word_count = 0
+        for token in doc:
+            if not token.is_punct:
+                word_count += 1
+            if token.dep_ == 'mark':
+                num_clauses += 1
+
+        # Check for complexity indicators, counting each distinct keyword once
+        complex_indicators = len({
+            keyword for keyword, _ in self._match_keywords(self._complex_keywords, doc)
+        })
+        expert_indicators = len({
+            keyword for keyword, _ in self._match_keywords(self._expert_keywords, doc)
+        })
 
         # Determine complexity based on multiple factors
         if expert_indicators > 0 or (complex_indicators >= 2 and num_clauses >= 3):
@@ -153,47 +402,52 @@ class QueryClassifier:
 
     def _extract_entities(self, doc) -> List[Dict[str, str]]:
         """Extract and categorize named entities from the query."""
-        entities = []
-        for ent in doc.ents:
-            entities.append({
+        ents = doc.ents
+        entities = [None] * len(ents)
+        for i, ent in enumerate(ents):
+            entities[i] = {
                 'text': ent.text,
                 'type': ent.label_,
                 'start': ent.start_char,
                 'end': ent.end_char
-            })
+            }
         return entities
 
-    def _identify_temporal_context(self, query: str, doc) -> Dict[str, any]:
+    def _identify_temporal_context(
+        self,
+        query: str,
+        doc,
+        temporal_matches: Optional[List[Tuple[str, Span]]] = None
+    ) -> Dict[str, any]:
         """Identify temporal aspects of the query."""
-        temporal_context = {
-            'has_temporal_aspect': False,
-            'temporal_type': None,
-            'temporal_references': []
-        }
-
         # Check for temporal indicators
-        for pattern in self.patterns['temporal_indicators']:
-            matches = re.finditer(pattern, query.lower())
-            for match in matches:
-                temporal_context['has_temporal_aspect'] = True
-                temporal_context['temporal_references'].append({
-                    'text': match.group(),
-                    'start': match.start(),
-                    'end': match.end()
-                })
+        if temporal_matches is None:
+            temporal_matches = self._match_keywords(self._temporal_keywords, doc)
+        temporal_references = [
+            {
+                'text': span.text,
+                'start': span.start_char,
+                'end': span.end_char
+            }
+            for _, span in temporal_matches
+        ]
 
         # Extract temporal entities from spaCy
-        temporal_ents = [ent for ent in doc.ents if ent.label_ in ['DATE', 'TIME']]
-        for ent in temporal_ents:
-            temporal_context['has_temporal_aspect'] = True
-            temporal_context['temporal_references'].append({
+        temporal_references.extend(
+            {
                 'text': ent.text,
                 'type': ent.label_,
                 'start': ent.start_char,
                 'end': ent.end_char
-            })
+            }
+            for ent in doc.ents if ent.label_ in TEMPORAL_ENTITY_LABELS
+        )
 
-        return temporal_context
+        return {
+            'has_temporal_aspect': bool(temporal_references),
+            'temporal_type': None,
+            'temporal_references': temporal_references
+        }
 
     def _generate_augmentation_suggestions(
         self,
@@ -209,7 +463,7 @@ class QueryClassifier:
         if query_type == QueryType.COMPLIANCE:
             suggestions.append("Include relevant regulatory framework references")
 
-        if complexity in [QueryComplexity.COMPLEX, QueryComplexity.EXPERT]:
+        if complexity >= QueryComplexity.COMPLEX:
             suggestions.append("Break down into sub-queries for detailed analysis")
 
         if not entities:
@@ -230,12 +484,7 @@ class QueryClassifier:
         entity_factor = min(len(entities) * 0.1, 0.2)
 
         # Adjust based on complexity
-        complexity_factor = {
-            QueryComplexity.SIMPLE: 0.1,
-            QueryComplexity.MODERATE: 0.05,
-            QueryComplexity.COMPLEX: -0.05,
-            QueryComplexity.EXPERT: -0.1
-        }[complexity]
+        complexity_factor = _COMPLEXITY_FACTOR[complexity]
 
         # Calculate final confidence
         confidence = base_confidence + entity_factor + complexity_factor